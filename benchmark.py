@@ -0,0 +1,197 @@
+# benchmark.py
+# times the simulation, sensing, breeding and drawing of pyparticles, printing the results as JSON
+#
+#     python benchmark.py --output before.json
+#     python benchmark.py --render --seconds 5 > after.json
+
+import argparse, contextlib, json, math, os, platform, sys, time
+import numpy
+import pyparticles
+
+(width, height) = (1200, 450)
+track = 'track.bmp'
+checkpoints = [(400,150),(500,70),(600,60),(640,140),(605,210),(680,300),(720,380),(580,390),(450,350),(320,320),(250,235),(110,325),(60,200),(125,75),(290,90)]
+
+def ring(road_width, shape=(450, 800)):
+	'''a synthetic track: an elliptical ring road road_width pixels across, or an open box if
+	road_width is None, with checkpoints spaced around it'''
+
+	rows, cols = shape
+	y, x = numpy.mgrid[0:rows, 0:cols]
+	a, b = (cols - 100)/2, (rows - 100)/2
+	road = (x > 30) & (x < cols - 30) & (y > 30) & (y < rows - 30)
+	if road_width is not None:
+		# distance from the ellipse, to first order
+		dx, dy = (x - cols/2)/a, (y - rows/2)/b
+		r = numpy.hypot(dx, dy)
+		gradient = numpy.hypot(dx/a, dy/b)/numpy.maximum(r, 1e-9)
+		road &= abs(r - 1) < gradient*road_width/2
+
+	angles = numpy.linspace(0, 2*math.pi, 12, endpoint=False)
+	points = [(int(cols/2 + a*math.cos(t)), int(rows/2 + b*math.sin(t))) for t in angles]
+	return road.astype(numpy.uint8), points
+
+def tracks():
+	'''every track to run on, by name, as image and checkpoints'''
+
+	found = {}
+	if os.path.exists(track):
+		found['track.bmp'] = (track, checkpoints)
+	for name, road_width in (('ring20', 20), ('ring60', 60), ('ring150', 150), ('open', None)):
+		found[name] = ring(road_width)
+	return found
+
+def place(env, n, car_size=5):
+	'''random spots on the road of env's track, clear of the walls'''
+
+	rows, cols = numpy.nonzero(env.field > car_size + 1)
+	spots = numpy.random.randint(0, len(rows), n)
+	return cols[spots] + 0.5, rows[spots] + 0.5
+
+def environment(image, points, n, colliding, vectorised, fov=None):
+	'''an Environment with n random drivers spread over the track'''
+
+	env = pyparticles.Environment((width, height), image=image, checkpoints=points, colliding=colliding, vectorised=vectorised)
+	layout = pyparticles.GenomeLayout()
+	genomes = layout.random(n)
+	if fov is not None:
+		genomes[:, layout.fov] = fov
+	x, y = place(env, n)
+	if vectorised:
+		env.addGenomes(genomes, layout, x=x, y=y, speed=0, size=5)
+	else:
+		for genome, x_i, y_i in zip(genomes, x, y):
+			control_rods, bias, fov_i, colour = layout.unpack(genome)
+			env.addParticles(1, x=x_i, y=y_i, speed=0, size=5, control_rods=control_rods, bias=bias, fov=fov_i, colour=colour)
+
+	# start the clock a tick in, as cars spread over the track may begin on a checkpoint
+	env.ticks = 1
+	env.time_elapsed = 1000/60
+	return env
+
+def timed(function, seconds, min_calls=3, max_calls=None):
+	'''call function repeatedly for about seconds, returning the number of calls and the time they took'''
+
+	function()
+	calls = 0
+	start = time.perf_counter()
+	elapsed = 0
+	while (calls < min_calls or elapsed < seconds) and (max_calls is None or calls < max_calls):
+		function()
+		calls += 1
+		elapsed = time.perf_counter() - start
+	return calls, elapsed
+
+def bench_update(found, sizes, seconds, scalar_max, max_ticks):
+	'''ticks per second of Environment.update, batched and (for small populations) one car at a time'''
+
+	results = []
+	for name, (image, points) in found.items():
+		for n in sizes:
+			for colliding in (False, True):
+				for vectorised in (True, False):
+					if not vectorised and n > scalar_max:
+						continue
+					env = environment(image, points, n, colliding, vectorised)
+					ticks, elapsed = timed(lambda: env.advance(1000/60), seconds, max_calls=max_ticks)
+					results.append({'track': name, 'population': n, 'colliding': colliding, 'vectorised': vectorised,
+						'ticks': ticks, 'seconds': elapsed, 'ticks_per_second': ticks/elapsed, 'car_ticks_per_second': n*ticks/elapsed})
+	return results
+
+def bench_distances(found, fovs, seconds, n=300):
+	'''cost per car of measuring its three wall distances, by Environment.distances and by sensors,
+	both marched and sphere traced'''
+
+	results = []
+	for name, (image, points) in found.items():
+		for fov in fovs:
+			env = environment(image, points, n, False, False, fov=fov)
+			p = env.particles
+			x, y = numpy.array([q.x for q in p]), numpy.array([q.y for q in p])
+			heading = numpy.random.uniform(0, 2*math.pi, n)
+			for q, angle in zip(p, heading):
+				q.angle = angle
+			fov_column = numpy.full(n, float(fov))
+
+			methods = (('distances', lambda: [env.distances(q) for q in p]),
+				('march', lambda: pyparticles.sensors(env.track, x, y, heading, fov_column)),
+				('trace', lambda: pyparticles.sensors(env.track, x, y, heading, fov_column, env.field)))
+			for method, function in methods:
+				calls, elapsed = timed(function, seconds)
+				results.append({'track': name, 'fov': fov, 'method': method, 'cars': n,
+					'calls': calls, 'seconds': elapsed, 'microseconds_per_car': 1e6*elapsed/(calls*n)})
+	return results
+
+def bench_breed(found, sizes, seconds):
+	'''children bred per second, by breed_generation and by breed one pair at a time'''
+
+	results = []
+	layout = pyparticles.GenomeLayout()
+	for n in sizes:
+		parents = layout.random(n)
+		pairs = numpy.random.randint(0, n, (n, 2))
+		calls, elapsed = timed(lambda: pyparticles.breed_generation(parents, pairs, layout), seconds)
+		results.append({'method': 'breed_generation', 'population': n,
+			'generations': calls, 'seconds': elapsed, 'children_per_second': n*calls/elapsed})
+
+	p1, p2 = environment(*found['ring60'], 2, False, False).particles
+	calls, elapsed = timed(lambda: pyparticles.breed(p1, p2), seconds)
+	results.append({'method': 'breed', 'population': 1, 'generations': calls, 'seconds': elapsed, 'children_per_second': calls/elapsed})
+	return results
+
+def bench_render(sizes, seconds):
+	'''frames per second of the renderer on track.bmp, drawn to a dummy SDL display'''
+
+	os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+	import pygame, renderer
+
+	pygame.init()
+	screen = pygame.display.set_mode((width, height))
+	results = []
+	for n in sizes:
+		env = environment(track, checkpoints, n, False, True)
+		display = renderer.Renderer(screen, track, env.colour, checkpoints)
+		env.update()
+		frames, elapsed = timed(lambda: display.draw(env), seconds)
+		results.append({'population': n, 'frames': frames, 'seconds': elapsed, 'frames_per_second': frames/elapsed})
+	pygame.quit()
+	return results
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Time the simulation, sensing, breeding and drawing of pyparticles.')
+	parser.add_argument('--output', help='write the JSON results here rather than to stdout')
+	parser.add_argument('--seconds', type=float, default=1, help='time to spend on each case')
+	parser.add_argument('--sizes', type=int, nargs='+', default=[10, 300, 3000], help='population sizes to step')
+	parser.add_argument('--scalar-max', type=int, default=300, help='largest population to step one car at a time')
+	parser.add_argument('--max-ticks', type=int, default=None, help='most ticks to time for any one case')
+	parser.add_argument('--fovs', type=float, nargs='+', default=[10, 45, 80], help='sensor angles to measure distances at')
+	parser.add_argument('--render', action='store_true', help='also time drawing, with a dummy video driver')
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args(argv)
+
+	pyparticles.seed(args.seed)
+	found = tracks()
+
+	results = {
+		'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'python': sys.version.split()[0], 'numpy': numpy.__version__, 'platform': platform.platform(),
+		'settings': vars(args),
+	}
+
+	# fastest laps are announced on stdout, so keep them out of the results
+	with contextlib.redirect_stdout(sys.stderr):
+		results['update'] = bench_update(found, args.sizes, args.seconds, args.scalar_max, args.max_ticks)
+		results['distances'] = bench_distances(found, args.fovs, args.seconds)
+		results['breed'] = bench_breed(found, args.sizes, args.seconds)
+		if args.render and os.path.exists(track):
+			results['render'] = bench_render(args.sizes, args.seconds)
+
+	text = json.dumps(results, indent=1)
+	if args.output:
+		with open(args.output, 'w') as f:
+			f.write(text + '\n')
+	else:
+		print(text)
+
+if __name__ == '__main__':
+	main()
@@ -1,9 +1,14 @@
 # gaming_assembly.py
 # uses pyparticles to create displayed game
+#
+#     python gaming_assembly.py --headless --n-generations 100 --no-race
+#
+# pygame is only imported once there is something to draw, so this module, and the worker processes
+# that evaluate drivers for it, can be imported without starting a display
 
-import pygame
-import pyparticles
-import random, math, itertools, time, pickle
+import argparse, inspect, time, os
+import numpy
+import pyparticles, training, store, traces, tournament
 
 # declare size of window and track to use
 (width, height) = (1200, 450)
@@ -11,195 +16,236 @@ track = 'track.bmp'
 # given track, place checkpoints
 checkpoints = [(400,150),(500,70),(600,60),(640,140),(605,210),(680,300),(720,380),(580,390),(450,350),(320,320),(250,235),(110,325),(60,200),(125,75),(290,90)]
 
+# further tracks to train on at the same time, as (image, checkpoints) pairs; every driver races each
+# track in the same batched step, and its fitness is its mean score over all of them
+extra_tracks = []
+
 # set up run parameters
 duration = 60
 n_generations = 40
 generation_size = 300
 n_to_keep = 10
-
-# for ease, define colours here
-RED = (255,0,0)
-WHITE = (255,255,255)
-GREY = (230,230,230)
-BLUE = (0,0,255)
-BLACK = (0,0,0)
-
-# Train to create save file of best racers, Race to race them on a starting grid
+# the best elites drivers of each generation go on to the next unchanged
+elites = 0
+
+# headless training advances in fixed ticks of 1/fps simulated seconds as fast as the CPU allows,
+# drawing only every render_every generations (0 for never); a seed makes the run reproducible
+headless = False
+fps = 60
+render_every = 0
+seed = None
+
+# each tick moves the cars on by timestep of the usual 1/fps second ticks, headless runs taking that many times
+# fewer ticks of that many times longer to drive for duration, in substeps stages each checked against the walls; swept stops cars where their path first meets a wall,
+# so that fast cars cannot pass through thin ones
+timestep = 1
+substeps = 1
+swept = False
+
+# in headless runs, cars that pass no checkpoint for cull_after simulated seconds are frozen with their score and
+# no longer simulated, and a generation ends once every car is (None to simulate every car for the whole duration).
+# Otherwise generations run on the wall clock, where ticks are no measure of time, and every car drives to the end
+cull_after = 10
+
+# headless, drive a generation in stages: after halving_after simulated seconds only the best halving_keep of the drivers
+# go on, and after each stage 1/halving_keep times as long, until the survivors have had the whole duration.
+# Drivers are ranked on the stage they reached before their score (None to drive every car for the whole duration)
+halving_after = None
+halving_keep = 0.5
+
+# headless generations that are not drawn can be scored across this many worker processes (0 to run here)
+workers = 0
+
+# train headless as this many islands, each of generation_size/islands drivers evolving in its own process,
+# sending copies of its best migrants drivers to others every migration_interval generations along
+# topology: 'ring' to the next island, 'full' to all of them, or 'random' to one picked each time (0 for one population)
+# Islands keep elites but score every driver themselves, so take no workers, fitness_cache or halving_after
+islands = 0
+migration_interval = 5
+migrants = 2
+topology = 'ring'
+
+# headless generations that are not drawn remember the scores of up to fitness_cache drivers, and only
+# drive the ones they have not seen (0 for no cache)
+fitness_cache = 0
+
+# keep tracks as one byte per pixel and genomes as float32, for very large populations
+compact = False
+
+# print where the time of each generation went, phase by phase
+stats = False
+
+# draw only every frame_skip+1 ticks, and at most target_fps frames a second (None for no limit)
+frame_skip = 0
+target_fps = None
+
+# every generation is saved to store_path as it is scored; with resume a run picks up after the last one saved
+store_path = 'drivers.gen'
+resume = False
+
+# the race is recorded to trace_path as it runs (None to not record it), and replayed from there
+# replay_speed ticks to a frame
+trace_path = 'race.trace'
+replay_speed = 4
+
+# the race, and every heat of a tournament, has grid_size cars lined up behind the first checkpoint. A tournament
+# ranks the best tournament_drivers drivers of each of the last tournament_generations generations saved, over
+# tournament_rounds rounds of heats drawn at random, raced headless with collisions (on workers processes if set)
+grid_size = 10
+tournament_drivers = 50
+tournament_generations = 4
+tournament_rounds = 20
+
+# Train to create save file of best racers, Race to race them on a starting grid, Replay to watch the race again,
+# Tournament to rank them; running this file, these and the settings above can be given on the command line
 Train = True
 Race = True
-
-if Train:
-	
-	# initiate display and display options
-	screen = pygame.display.set_mode((width, height))
+Replay = False
+Tournament = False
+
+def train(*, width=width, height=height, track=track, checkpoints=checkpoints, extra_tracks=extra_tracks, duration=duration,
+		n_generations=n_generations, generation_size=generation_size, n_to_keep=n_to_keep, elites=elites, headless=headless, fps=fps,
+		render_every=render_every, seed=seed, timestep=timestep, substeps=substeps, swept=swept, cull_after=cull_after,
+		halving_after=halving_after, halving_keep=halving_keep, workers=workers, islands=islands, migration_interval=migration_interval,
+		migrants=migrants, topology=topology, fitness_cache=fitness_cache, compact=compact, stats=stats, frame_skip=frame_skip,
+		target_fps=target_fps, store_path=store_path, resume=resume):
+	'''evolve generations of drivers, saving every one to store_path. Every setting defaults to the one above'''
+
+	if islands:
+		unsupported = [name for name, value in (('workers', workers), ('fitness_cache', fitness_cache), ('halving_after', halving_after)) if value]
+		if unsupported:
+			raise ValueError('islands train without '+', '.join(unsupported)+'; leave them unset')
+	if seed is not None:
+		pyparticles.seed(seed)
+
+	# display options, the window itself is only opened once there is something to draw
+	screen = None
 	lines = False
 	display_checkpoints = True
 
-	# initialise environment
-	env = pyparticles.Environment((width, height),image=track,checkpoints=checkpoints,colliding=False)
-
-	# add initial particles
-	for i in range(generation_size):	
-		fov = random.uniform(0,90)
-		env.addParticles(1, x=checkpoints[0][0], y=checkpoints[0][1], speed=0, size=5)
-
-	# display text
-	pygame.init()
-	pygame.display.set_caption('Generation 1')
-	basicfont = pygame.font.Font(None, 32)
-	text_string = 'LEADERBOARD'
-	header = basicfont.render(text_string, True, RED, WHITE)
-	headerRect = header.get_rect()   
-	headerRect.center = (800+200, 40)
-
-	n = 0
-	while n < n_generations:
-
-		print('##################')
-		print('## GENERATION '+str(n+1)+' ##')
-		print('##################')
-
-		pygame.display.set_caption('Generation '+str(n+1))
-
-		particle_list = env.particles
-
-		# set up background
-		track_image = pygame.image.load(track)
-		track_rect = track_image.get_rect()
-		track_rect.left, track_rect.left = [0,0]
-
-		# initiate run
-		pygame.init()
-		running = True
-		start_time = time.time()
-		current_time = time.time()
-
-		while current_time - start_time < duration and running == True:
-			for event in pygame.event.get():
-				if event.type == pygame.QUIT:
-					running = False
-
-			# draw background
-			env.update()
-			screen.fill(env.colour)
-			screen.blit(track_image,track_rect)
-
-			# draw cars and their lines, if requested
-			for p in env.particles:
-				
-				angle = math.pi - p.angle
-				fov = p.fov*math.pi/180
-				if lines:
-					pygame.draw.line(screen, p.colour, (int(p.x), int(p.y)), (int(p.x)+p.distance_front*math.sin(angle),int(p.y)+p.distance_front*math.cos(angle)))
-					pygame.draw.line(screen, p.colour, (int(p.x), int(p.y)), (int(p.x)+p.distance_left*math.sin(angle+fov),int(p.y)+p.distance_left*math.cos(angle+fov)))
-					pygame.draw.line(screen, p.colour, (int(p.x), int(p.y)), (int(p.x)+p.distance_right*math.sin(angle-fov),int(p.y)+p.distance_right*math.cos(angle-fov)))
-				
-				pygame.draw.circle(screen, p.colour, (int(p.x), int(p.y)), p.size, p.thickness)
-
-			sorted_list = sorted(particle_list, key=lambda particle:particle.score)[::-1]
-			
-			### draw leaderboard: particle number, colour, score, controls
-			screen.blit(header, headerRect)
-
-			for i in range(0,10):
-				
-				p = sorted_list[i]
-
-				leader_x = 800 + 75
-				leader_y = 80 + i*35
-
-				numberplate = basicfont.render(str(i+1), True, BLACK, WHITE)
-				numberRect = numberplate.get_rect()   
-				numberRect.center = (leader_x - 10, leader_y)
-				screen.blit(numberplate, numberRect)
-				
-				pygame.draw.circle(screen, p.colour, (leader_x + 20, leader_y), p.size, p.thickness)
-				
-				nameplate = basicfont.render(str(p.name), True, BLACK, WHITE)
-				nameRect = nameplate.get_rect()   
-				nameRect.midleft = (leader_x + 45, leader_y)
-				screen.blit(nameplate, nameRect)
-				
-				scoreplate = basicfont.render(str(round(p.score,3)), True, BLACK, WHITE)
-				scoreRect = scoreplate.get_rect()   
-				scoreRect.midleft = (leader_x + 100, leader_y)
-				screen.blit(scoreplate, scoreRect)		
-				
-				if p.w:
-					wplate = basicfont.render('W', True, BLACK, WHITE)
-				else:
-					wplate = basicfont.render('W', True, GREY, WHITE)
-				wRect = wplate.get_rect()   
-				wRect.center = (leader_x + 190, leader_y)
-				screen.blit(wplate, wRect)		
-
-				if p.a:
-					aplate = basicfont.render('A', True, BLACK, WHITE)
+	# headless generations run ticks ticks of dt milliseconds, each timestep of the usual ticks
+	ticks, dt = duration*fps/timestep, timestep*1000/fps
+	culling = pyparticles.Culling(progress_ticks=cull_after*fps/timestep) if cull_after is not None else None
+	layout = pyparticles.GenomeLayout(dtype=numpy.float32 if compact else numpy.float64)
+	images = [track] + [image for image, points in extra_tracks]
+	all_checkpoints = [checkpoints] + [points for image, points in extra_tracks]
+
+	# start from random genomes, or breed on from the last generation saved
+	if resume and os.path.exists(store_path):
+		drivers = store.GenomeStore(store_path, layout)
+	else:
+		drivers = store.GenomeStore.create(store_path, layout)
+	n = len(drivers)
+	if n:
+		drivers.restore()
+		genomes = training.next_generation(*drivers.generation(), layout, generation_size, n_to_keep, elites=elites)
+	else:
+		genomes = layout.random(generation_size)
+
+	if islands and n < n_generations:
+		def report(generation, genomes, scores):
+			print('generation '+str(generation+1)+': best '+str(round(scores.max().item(),3))+', mean '+str(round(scores.mean().item(),3)))
+			drivers.append(genomes, scores)
+
+		model = training.IslandModel(islands, generation_size//islands, layout, migration_interval, migrants, topology, n_to_keep, elites, seed=seed or 0,
+			size=(width, height), image=images, checkpoints=all_checkpoints, ticks=duration*fps, dt=1000/fps, culling=culling, compact=compact, timestep=timestep, substeps=substeps, swept=swept)
+		model.run(n_generations - n, genomes if n else None, report, first=n)
+		n = n_generations
+
+	evaluator = None
+	if headless and workers:
+		evaluator = training.ParallelEvaluator(workers, seed=seed or 0, layout=layout, size=(width, height), image=images, checkpoints=all_checkpoints,
+			ticks=duration*fps, dt=1000/fps, culling=culling, compact=compact, timestep=timestep, substeps=substeps, swept=swept)
+		evaluator.generation = n
+
+	if headless and fitness_cache:
+		context = ([pyparticles.compile_track(image).key for image in images], all_checkpoints, duration*fps, fps, cull_after, timestep, substeps, swept)
+		cache = training.FitnessCache(fitness_cache, layout, context)
+
+	try:
+		while n < n_generations:
+
+			print('##################')
+			print('## GENERATION '+str(n+1)+' ##')
+			print('##################')
+
+			render = not headless or (render_every and n % render_every == 0)
+			if render and screen is None:
+				import pygame, renderer
+				screen = pygame.display.set_mode((width, height))
+				pygame.init()
+
+			halving = None
+			if headless and (workers or fitness_cache) and not render:
+				# score the whole generation on the worker pool instead of stepping it here, skipping any the cache knows
+				if workers:
+					evaluate = evaluator
 				else:
-					aplate = basicfont.render('A', True, GREY, WHITE)
-				aRect = aplate.get_rect()   
-				aRect.center = (leader_x + 212, leader_y)
-				screen.blit(aplate, aRect)		
-				
-				if p.s:
-					splate = basicfont.render('S', True, BLACK, WHITE)
+					evaluate = lambda genomes: training.evaluate(genomes, layout, (width, height), images, all_checkpoints, duration*fps, 1000/fps, culling=culling, compact=compact, timestep=timestep, substeps=substeps, swept=swept)
+				if fitness_cache:
+					scores = cache(genomes, evaluate)
+					print('fitness cache: '+str(cache.hits)+' hits, '+str(cache.misses)+' misses')
+					cache.reset_counts()
 				else:
-					splate = basicfont.render('S', True, GREY, WHITE)
-				sRect = splate.get_rect()   
-				sRect.center = (leader_x + 230, leader_y)
-				screen.blit(splate, sRect)		
-
-				if p.d:
-					dplate = basicfont.render('D', True, BLACK, WHITE)
-				else:
-					dplate = basicfont.render('D', True, GREY, WHITE)
-				dRect = dplate.get_rect()   
-				dRect.center = (leader_x + 250, leader_y)
-				screen.blit(dplate, dRect)		
-
-			### draw checkpoints
-			if display_checkpoints:
-				for pos in checkpoints:
-					pygame.draw.circle(screen,RED,pos,5,5)
-
-			pygame.display.flip()
-			current_time = time.time()
-			env.time_elapsed = int(round((current_time - start_time)*1000))
-
-		### BREED NEW GENERATION ###
-
-		sorted_list = sorted(particle_list, key=lambda particle:particle.score)[::-1]
-
-		env = pyparticles.Environment((width, height),image=track,checkpoints=checkpoints,colliding=False)
-		
-		for i in range(n_to_keep-1):
-
-			parent_pairs = list(itertools.combinations(range(i+1),2))
-
-			for pair in parent_pairs:
-				control_rods,bias,fov,colour = pyparticles.breed(sorted_list[pair[0]],sorted_list[pair[1]])
-				env.addParticles(1, x=checkpoints[0][0], y=checkpoints[0][1], speed=0, size=5, control_rods=control_rods, bias=bias, fov=fov, colour=colour)
-
-		while len(env.particles) < (generation_size - 5):
-			parent1 = sorted_list[random.randint(0,generation_size-1)]
-			parent2 = sorted_list[random.randint(0,generation_size-1)]
-			control_rods,bias,fov,colour = pyparticles.breed(parent1,parent2)
-			env.addParticles(1, x=checkpoints[0][0], y=checkpoints[0][1], speed=0, size=5, control_rods=control_rods, bias=bias, fov=fov, colour=colour)
-
-		while len(env.particles) < generation_size:
-			env.addParticles(1, x=checkpoints[0][0], y=checkpoints[0][1], speed=0, size=5)
-
-		# save these particles to file
-		with open('final_drivers','wb') as output:
-			driver_list = sorted_list[:10]
-			pickle.dump(driver_list, output)
-
-		n += 1
-
-if Race:
-	# load in drivers
-	with open('final_drivers','rb') as input:
-		driver_list = pickle.load(input)
+					scores = evaluate(genomes)
+			else:
+				# one particle on each track for each row of the population's genomes, stepped here
+				env = training.environment(genomes, layout, (width, height), images, all_checkpoints, culling=culling if headless else None, compact=compact, timestep=timestep, substeps=substeps, swept=swept)
+				if stats:
+					env.stats = pyparticles.Stats()
+				halving = training.SuccessiveHalving(env, ticks, int(halving_after*fps/timestep), halving_keep) if headless and halving_after is not None else None
+
+				if render:
+					pygame.display.set_caption('Generation '+str(n+1))
+					display = renderer.Renderer(screen, track, env.colour, checkpoints if display_checkpoints else (), lines, frame_skip, target_fps)
+
+				# initiate run
+				running = True
+				start_time = time.time()
+				current_time = time.time()
+
+				while running == True and not env.done and (env.ticks < ticks if headless else current_time - start_time < duration):
+					if render:
+						for event in pygame.event.get():
+							if event.type == pygame.QUIT:
+								running = False
+
+					if headless:
+						env.advance(dt)
+					else:
+						env.update()
+					if halving is not None:
+						halving()
+					if not render:
+						continue
+
+					display.draw(env)
+					if not headless:
+						current_time = time.time()
+						env.time_elapsed = int(round((current_time - start_time)*1000))
+
+				if stats and env.stats.ticks:
+					print(env.stats)
+				scores = training.fitness(env)
+
+			# save this generation to file, then breed the next
+			drivers.append(genomes, scores)
+			genomes = training.next_generation(genomes, scores, layout, generation_size, n_to_keep, elites=elites, stages=halving.stages if halving is not None else None)
+
+			n += 1
+	finally:
+		if evaluator is not None:
+			evaluator.close()
+
+def race(*, width=width, height=height, track=track, checkpoints=checkpoints, duration=duration, timestep=timestep, substeps=substeps,
+		swept=swept, compact=compact, frame_skip=frame_skip, target_fps=target_fps, store_path=store_path, trace_path=trace_path, grid_size=grid_size):
+	'''race the best drivers saved on a starting grid, recording the race to trace_path, and return the leaders'''
+
+	import pygame, renderer
+
+	# load in the best drivers of the last generation saved
+	drivers = store.GenomeStore(store_path)
+	driver_genomes, driver_scores = drivers.best(grid_size)
 
 	# initiate race window
 	pygame.display.set_caption('Race!')
@@ -207,42 +253,17 @@ if Race:
 	lines = False
 	display_checkpoints = False
 
-	# create starting grid based on initial checkpoint
-	spacing = 15
-	starting_grid = [(checkpoints[0][0],checkpoints[0][1]),
-		(checkpoints[0][0] - spacing, checkpoints[0][1]),
-		(checkpoints[0][0], checkpoints[0][1] - spacing),
-		(checkpoints[0][0] - spacing, checkpoints[0][1] - spacing),
-		(checkpoints[0][0] - 2*spacing, checkpoints[0][1]),
-		(checkpoints[0][0], checkpoints[0][1] - 2*spacing),
-		(checkpoints[0][0] - 2*spacing, checkpoints[0][1] - spacing),
-		(checkpoints[0][0] - 2*spacing, checkpoints[0][1] - 2*spacing),
-		(checkpoints[0][0] - spacing, checkpoints[0][1] - 2*spacing),
-		(checkpoints[0][0] - 3*spacing, checkpoints[0][1] - spacing)] 
-
-	env = pyparticles.Environment((width, height),image=track,checkpoints=checkpoints,colliding=False)
-
-	# load in drivers
-	i = 0
-	for p in driver_list:	
-		fov = random.uniform(0,90)
-		env.addParticles(1, x=starting_grid[i][0], y=starting_grid[i][1], speed=0, size=5, control_rods=p.control_rods, bias=p.bias, fov=p.fov)
-		i += 1
-	particle_list = env.particles
-
-	# set up background
-	track_image = pygame.image.load(track)
-	track_rect = track_image.get_rect()
-	track_rect.left, track_rect.left = [0,0]
+	env = pyparticles.Environment((width, height),image=track,checkpoints=checkpoints,colliding=False,vectorised=True,compact=compact)
+	env.timestep, env.substeps, env.swept = timestep, substeps, swept
 
-	pygame.init()
+	# put them on a grid behind the first checkpoint, facing the second
+	x, y, heading = tournament.starting_grid(env, len(driver_genomes))
+	env.addGenomes(driver_genomes, drivers.layout, x=x, y=y, angle=heading, speed=0, size=5)
+	if trace_path is not None:
+		env.trace = traces.Trace.create(trace_path, env, capacity=duration*1000)
 
-	# text preparation
-	basicfont = pygame.font.Font(None, 32)
-	text_string = 'LEADERBOARD'
-	header = basicfont.render(text_string, True, RED, WHITE)
-	headerRect = header.get_rect()   
-	headerRect.center = (800+200, 40)
+	pygame.init()
+	display = renderer.Renderer(screen, track, env.colour, checkpoints if display_checkpoints else (), lines, frame_skip, target_fps)
 
 	# begin run
 	running = True
@@ -253,93 +274,122 @@ if Race:
 			if event.type == pygame.QUIT:
 				running = False
 
-		# draw background
 		env.update()
-		screen.fill(env.colour)
-		screen.blit(track_image,track_rect)
-
-		# draw cars
-		for p in env.particles:
-			angle = math.pi - p.angle
-			fov = p.fov*math.pi/180
-			if lines:
-				pygame.draw.line(screen, p.colour, (int(p.x), int(p.y)), (int(p.x)+p.distance_front*math.sin(angle),int(p.y)+p.distance_front*math.cos(angle)))
-				pygame.draw.line(screen, p.colour, (int(p.x), int(p.y)), (int(p.x)+p.distance_left*math.sin(angle+fov),int(p.y)+p.distance_left*math.cos(angle+fov)))
-				pygame.draw.line(screen, p.colour, (int(p.x), int(p.y)), (int(p.x)+p.distance_right*math.sin(angle-fov),int(p.y)+p.distance_right*math.cos(angle-fov)))
-			pygame.draw.circle(screen, p.colour, (int(p.x), int(p.y)), p.size, p.thickness)
-
-			sorted_list = sorted(particle_list, key=lambda particle:particle.score)[::-1]
-			
-			### draw leaderboard 
-
-			screen.blit(header, headerRect)
-
-			for i in range(0,10):
-				
-				p = sorted_list[i]
-
-				leader_x = 800 + 75
-				leader_y = 80 + i*35
-
-				numberplate = basicfont.render(str(i+1), True, BLACK, WHITE)
-				numberRect = numberplate.get_rect()   
-				numberRect.center = (leader_x - 10, leader_y)
-				screen.blit(numberplate, numberRect)
-				
-				pygame.draw.circle(screen, p.colour, (leader_x + 20, leader_y), p.size, p.thickness)
-				
-				nameplate = basicfont.render(str(p.name), True, BLACK, WHITE)
-				nameRect = nameplate.get_rect()   
-				nameRect.midleft = (leader_x + 45, leader_y)
-				screen.blit(nameplate, nameRect)
-				
-				scoreplate = basicfont.render(str(round(p.score,3)), True, BLACK, WHITE)
-				scoreRect = scoreplate.get_rect()   
-				scoreRect.midleft = (leader_x + 100, leader_y)
-				screen.blit(scoreplate, scoreRect)		
-				
-				if p.w:
-					wplate = basicfont.render('W', True, BLACK, WHITE)
-				else:
-					wplate = basicfont.render('W', True, GREY, WHITE)
-				wRect = wplate.get_rect()   
-				wRect.center = (leader_x + 190, leader_y)
-				screen.blit(wplate, wRect)		
+		display.draw(env)
 
-				if p.a:
-					aplate = basicfont.render('A', True, BLACK, WHITE)
-				else:
-					aplate = basicfont.render('A', True, GREY, WHITE)
-				aRect = aplate.get_rect()   
-				aRect.center = (leader_x + 212, leader_y)
-				screen.blit(aplate, aRect)		
-				
-				if p.s:
-					splate = basicfont.render('S', True, BLACK, WHITE)
+		current_time = time.time()
+		env.time_elapsed = int(round((current_time - start_time)*100000))/100
 
-				else:
-					splate = basicfont.render('S', True, GREY, WHITE)
-				sRect = splate.get_rect()   
-				sRect.center = (leader_x + 230, leader_y)
-				screen.blit(splate, sRect)		
+	if env.trace is not None:
+		env.trace.close(env)
 
-				if p.d:
-					dplate = basicfont.render('D', True, BLACK, WHITE)
-				else:
-					dplate = basicfont.render('D', True, GREY, WHITE)
-				dRect = dplate.get_rect()   
-				dRect.center = (leader_x + 250, leader_y)
-				screen.blit(dplate, dRect)		
+	# sort the cars, produce a final leaderboard
+	return env.leaders(10)
 
-			# draw checkpoints
+def replay(*, width=width, height=height, track=track, checkpoints=checkpoints, timestep=timestep, substeps=substeps, swept=swept,
+		compact=compact, trace_path=trace_path, replay_speed=replay_speed):
+	'''play the race recorded at trace_path back from the drivers' keys alone, faster than it was run'''
 
-			if display_checkpoints:
-				for pos in checkpoints:
-					pygame.draw.circle(screen,RED,pos,5,5)
+	import pygame, renderer
 
-		pygame.display.flip()
-		current_time = time.time()
-		env.time_elapsed = int(round((current_time - start_time)*100000))/100
+	trace = traces.Trace(trace_path)
+	env = pyparticles.Environment((width, height),image=track,checkpoints=checkpoints,colliding=False,vectorised=True,compact=compact)
+	env.timestep, env.substeps, env.swept = timestep, substeps, swept
 
-	# sort the cars, produce a final leaderboard
-	sorted_list = sorted(particle_list, key=lambda particle:particle.score)[::-1][:10]
\ No newline at end of file
+	pygame.display.set_caption('Replay')
+	screen = pygame.display.set_mode((width, height))
+	pygame.init()
+	display = renderer.Renderer(screen, track, env.colour)
+
+	for tick in trace.replay(env, every=replay_speed):
+		if any(event.type == pygame.QUIT for event in pygame.event.get()):
+			break
+		display.draw(env)
+
+	for car in range(len(trace.cars)):
+		lap = trace.lap(car)
+		if lap is not None:
+			print('Particle '+str(trace.cars[car]['name'])+': fastest lap from tick '+str(lap[0])+' to '+str(lap[1]))
+
+def rank_drivers(*, width=width, height=height, track=track, checkpoints=checkpoints, duration=duration, fps=fps, seed=seed,
+		timestep=timestep, substeps=substeps, swept=swept, cull_after=cull_after, workers=workers, compact=compact, store_path=store_path,
+		grid_size=grid_size, tournament_drivers=tournament_drivers, tournament_generations=tournament_generations, tournament_rounds=tournament_rounds):
+	'''rank the best drivers of the last generations saved by racing them against each other in a
+	headless tournament, printing the top of the table, and return the Ranking with each driver's
+	generation and place within it'''
+
+	if seed is not None:
+		pyparticles.seed(seed)
+
+	drivers = store.GenomeStore(store_path)
+	generations = range(max(len(drivers) - tournament_generations, 0), len(drivers))
+	genomes, labels = tournament.entrants(drivers, tournament_drivers, generations)
+	culling = pyparticles.Culling(progress_ticks=cull_after*fps/timestep) if cull_after is not None else None
+	ranking = tournament.run(genomes, drivers.layout, tournament_rounds, grid_size, workers, seed or 0,
+		size=(width, height), image=track, checkpoints=checkpoints, ticks=duration*fps, dt=1000/fps, culling=culling, compact=compact,
+		timestep=timestep, substeps=substeps, swept=swept)
+
+	print('rank  generation  place  rating  points  wins')
+	for rank, i in enumerate(ranking.order()[:20]):
+		generation, place = labels[i]
+		print('%4d  %10d  %5d  %6.0f  %6d  %4d' % (rank + 1, generation + 1, place + 1, ranking.ratings[i], ranking.points[i], ranking.wins[i]))
+	return ranking, labels
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Train drivers by genetic algorithm, race the best of them, replay the race and rank them in a tournament.')
+	parser.add_argument('--duration', type=int, default=duration, help='seconds each generation, and the race, is driven for')
+	parser.add_argument('--n-generations', type=int, default=n_generations)
+	parser.add_argument('--generation-size', type=int, default=generation_size)
+	parser.add_argument('--n-to-keep', type=int, default=n_to_keep, help='drivers every pairing of which is bred')
+	parser.add_argument('--elites', type=int, default=elites, help='drivers carried over to the next generation unchanged')
+	parser.add_argument('--headless', action=argparse.BooleanOptionalAction, default=headless, help='train in fixed ticks as fast as possible')
+	parser.add_argument('--fps', type=int, default=fps, help='ticks a simulated second')
+	parser.add_argument('--render-every', type=int, default=render_every, help='draw every this many headless generations (0 for never)')
+	parser.add_argument('--seed', type=int, default=seed)
+	parser.add_argument('--timestep', type=float, default=timestep)
+	parser.add_argument('--substeps', type=int, default=substeps)
+	parser.add_argument('--swept', action=argparse.BooleanOptionalAction, default=swept)
+	parser.add_argument('--cull-after', type=float, default=cull_after)
+	parser.add_argument('--no-cull', dest='cull_after', action='store_const', const=None, help='simulate every car for the whole duration')
+	parser.add_argument('--halving-after', type=float, default=halving_after)
+	parser.add_argument('--halving-keep', type=float, default=halving_keep)
+	parser.add_argument('--workers', type=int, default=workers)
+	parser.add_argument('--islands', type=int, default=islands)
+	parser.add_argument('--migration-interval', type=int, default=migration_interval)
+	parser.add_argument('--migrants', type=int, default=migrants)
+	parser.add_argument('--topology', choices=training.topologies, default=topology)
+	parser.add_argument('--fitness-cache', type=int, default=fitness_cache)
+	parser.add_argument('--compact', action=argparse.BooleanOptionalAction, default=compact)
+	parser.add_argument('--stats', action=argparse.BooleanOptionalAction, default=stats)
+	parser.add_argument('--frame-skip', type=int, default=frame_skip)
+	parser.add_argument('--target-fps', type=float, default=target_fps)
+	parser.add_argument('--store-path', default=store_path)
+	parser.add_argument('--resume', action=argparse.BooleanOptionalAction, default=resume)
+	parser.add_argument('--trace-path', default=trace_path)
+	parser.add_argument('--replay-speed', type=int, default=replay_speed)
+	parser.add_argument('--grid-size', type=int, default=grid_size)
+	parser.add_argument('--tournament-drivers', type=int, default=tournament_drivers)
+	parser.add_argument('--tournament-generations', type=int, default=tournament_generations)
+	parser.add_argument('--tournament-rounds', type=int, default=tournament_rounds)
+	parser.add_argument('--train', dest='Train', action=argparse.BooleanOptionalAction, default=Train)
+	parser.add_argument('--race', dest='Race', action=argparse.BooleanOptionalAction, default=Race)
+	parser.add_argument('--replay', dest='Replay', action=argparse.BooleanOptionalAction, default=Replay)
+	parser.add_argument('--tournament', dest='Tournament', action=argparse.BooleanOptionalAction, default=Tournament)
+
+	args = vars(parser.parse_args(argv))
+
+	def settings(section):
+		# the settings given on the command line that section takes
+		return dict((name, args[name]) for name in inspect.signature(section).parameters if name in args)
+
+	if args['Train']:
+		train(**settings(train))
+	if args['Race']:
+		race(**settings(race))
+	if args['Replay']:
+		replay(**settings(replay))
+	if args['Tournament']:
+		rank_drivers(**settings(rank_drivers))
+
+if __name__ == '__main__':
+	main()
\ No newline at end of file
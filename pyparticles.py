@@ -1,12 +1,17 @@
 # pyparticles - module for particle interactions in pygame
 
-import math, random
-from PIL import Image
+import math, random, os, hashlib, time
+import numpy
 from numpy import array, dot
 from numpy.random import rand
 
 Bounce = True
 
+def seed(n):
+	'''seed both random number generators used here, making a fixed-tick run reproducible'''
+	random.seed(n)
+	numpy.random.seed(n)
+
 def addVectors(vector1,vector2):
 	'''simple vector addition'''
 	angle1 = vector1[0]
@@ -45,6 +50,56 @@ def collide(p1, p2):
 		p2.x -= math.sin(angle)*overlap
 		p2.y += math.cos(angle)*overlap
 
+def batch_add_vectors(angle1, length1, angle2, length2):
+	'''addVectors for arrays of vectors'''
+
+	x = numpy.sin(angle1)*length1 + numpy.sin(angle2)*length2
+	y = numpy.cos(angle1)*length1 + numpy.cos(angle2)*length2
+
+	return 0.5*numpy.pi - numpy.arctan2(y, x), numpy.hypot(x, y)
+
+def collision_pairs(x, y, size, group=None):
+	'''Broad phase for collide: hash the particles into a uniform grid of cells as wide as the largest
+	contact distance and return the pairs (i, j), i < j, that share or neighbour a cell, in the
+	order update() would test them. Only these pairs can be touching. Given an array of non-negative
+	group numbers, each group has a grid of its own, so particles in different groups are never paired'''
+
+	n = len(x)
+	if n < 2:
+		return numpy.zeros((0, 2), dtype=int)
+
+	cell = 2*max(size.max(), 1)
+	cell_x = numpy.floor(x/cell).astype(int)
+	cell_y = numpy.floor(y/cell).astype(int)
+	cell_x -= cell_x.min()
+	cell_y -= cell_y.min() - 1
+	span = cell_y.max() + 2
+	key = cell_x*span + cell_y
+	if group is not None:
+		# room for a column past the last, so that neighbouring cells never reach the next group's grid
+		key += numpy.asarray(group)*(cell_x.max() + 2)*span
+
+	order = numpy.argsort(key, kind='stable')
+	sorted_key = key[order]
+
+	pairs = []
+	# half of the neighbourhood is enough to see every pair of neighbouring cells once
+	for dx, dy in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+		target = key + dx*span + dy
+		start = numpy.searchsorted(sorted_key, target, side='left')
+		stop = numpy.searchsorted(sorted_key, target, side='right')
+		count = stop - start
+		first = numpy.repeat(numpy.arange(n), count)
+		offset = numpy.arange(count.sum()) - numpy.repeat(numpy.cumsum(count) - count, count)
+		second = order[numpy.repeat(start, count) + offset]
+		if dx == dy == 0:
+			keep = first < second
+			first, second = first[keep], second[keep]
+		pairs.append(numpy.stack((numpy.minimum(first, second), numpy.maximum(first, second)), axis=1))
+
+	pairs = numpy.concatenate(pairs)
+	return pairs[numpy.lexsort((pairs[:,1], pairs[:,0]))]
+
 def breed(p1,p2):
 	'''given p1 and p2, produce an offspring with characteristics from both
 	there is an equal chance of inheriting any characteristic'''
@@ -57,25 +112,27 @@ def breed(p1,p2):
 	
 	variation = 0.05
 	
-	control_rods = rand(p1.control_rods.shape[0],p1.control_rods.shape[1])
-	for i in range(control_rods.shape[0]):
-		
-		for j in range(control_rods.shape[1]):
-	
+	def mix(a, b):
+		child = rand(*a.shape)
+		for index in numpy.ndindex(a.shape):
+
 			coin = random.randint(0,1)
 
 			if coin == 1:
-				control_rods[i,j] = p1.control_rods[i,j] + random.uniform(-variation,variation)
+				child[index] = a[index] + random.uniform(-variation,variation)
 			else:
-				control_rods[i,j] = p2.control_rods[i,j] + random.uniform(-variation,variation)
-	
-	bias = rand(len(p1.bias))
-	for i in range(len(bias)):
-		coin = random.randint(0,1)
-		if coin == 1:
-			bias[i] = p1.bias[i] + random.uniform(-variation,variation)
-		else:
-			bias[i] = p2.bias[i] + random.uniform(-variation,variation)
+				child[index] = b[index] + random.uniform(-variation,variation)
+		return child
+
+	# multi-layer networks carry a list of control rods and biases, one per layer
+	if isinstance(p1.control_rods, list):
+		control_rods, bias = [], []
+		for (rods1, bias1), (rods2, bias2) in zip(layers(p1.control_rods, p1.bias), layers(p2.control_rods, p2.bias)):
+			control_rods.append(mix(rods1, rods2))
+			bias.append(mix(bias1, bias2))
+	else:
+		control_rods = mix(p1.control_rods, p2.control_rods)
+		bias = mix(p1.bias, p2.bias)
 
 	coin = random.randint(0,1)
 	if coin == 1:
@@ -85,7 +142,603 @@ def breed(p1,p2):
 	
 	return control_rods, bias, fov, colour
 
+def outside(x, y, width, height):
+	# points off an image of the given size, which march and trace count as wall
+	return (x < 0) | (x >= width) | (y < 0) | (y >= height)
+
+def march(track, x, y, angle, step=2, chunk=16, stats=None, layer=None):
+	'''march rays from (x, y) along angle, step pixels at a time, until each lands on a wall (track == 0),
+	everything outside the image counting as wall, and return the x and y of the points where they stopped. angle is measured as in Environment.distances.
+	Each pass tests the next chunk samples of every live ray at once, trading a little work past the
+	wall for far fewer trips round the loop. The rays and samples are counted in stats, if given.
+	track may be a stack of tracks, in which case layer gives the one each ray is cast on'''
+
+	height, width = track.shape[-2:]
+	flat_track = track.ravel()
+
+	x = numpy.array(x, dtype=float).ravel()
+	y = numpy.array(y, dtype=float).ravel()
+	angle = numpy.broadcast_to(angle, x.shape)
+	step_x = step*numpy.sin(angle)
+	step_y = step*numpy.cos(angle)
+	base = numpy.zeros(x.size, dtype=int) if layer is None else numpy.broadcast_to(layer, x.shape)*height*width
+
+	stop_x = numpy.empty_like(x)
+	stop_y = numpy.empty_like(y)
+	live = numpy.arange(x.size)
+	samples = numpy.arange(1, chunk+1)
+	if stats is not None:
+		stats.rays += x.size
+
+	while live.size:
+		if stats is not None:
+			stats.ray_steps += live.size*chunk
+		test_x = x[:,None] + step_x[:,None]*samples
+		test_y = y[:,None] + step_y[:,None]*samples
+		pixel = base[:,None] + test_y.astype(int).clip(0, height-1)*width + test_x.astype(int).clip(0, width-1)
+		wall = (flat_track[pixel] == 0) | outside(test_x, test_y, width, height)
+
+		hit = wall.any(axis=1)
+		first = wall[hit].argmax(axis=1)
+		stop_x[live[hit]] = test_x[hit, first]
+		stop_y[live[hit]] = test_y[hit, first]
+
+		miss = ~hit
+		x, y = test_x[miss, -1], test_y[miss, -1]
+		step_x, step_y = step_x[miss], step_y[miss]
+		base = base[miss]
+		live = live[miss]
+
+	return stop_x, stop_y
+
+def distance_field(track):
+	'''Euclidean distance from every pixel of track to the nearest wall pixel (track == 0),
+	treating everything outside the image as wall'''
+
+	wall = numpy.pad(track == 0, 1, constant_values=True)
+	height, width = wall.shape
+
+	# distance to the nearest wall in the same column, swept down and then back up
+	column = numpy.where(wall, 0, height).astype(float)
+	for i in range(1, height):
+		numpy.minimum(column[i], column[i-1] + 1, out=column[i])
+	for i in range(height-2, -1, -1):
+		numpy.minimum(column[i], column[i+1] + 1, out=column[i])
+
+	# combine the columns, widening the search until no pixel can get any closer
+	squared = column**2
+	field = squared.copy()
+	offset = 1
+	while offset**2 < field.max():
+		numpy.minimum(field[:, offset:], squared[:, :-offset] + offset**2, out=field[:, offset:])
+		numpy.minimum(field[:, :-offset], squared[:, offset:] + offset**2, out=field[:, :-offset])
+		offset += 1
+
+	return numpy.sqrt(field[1:-1, 1:-1]).astype(numpy.float32)
+
+def trace(field, x, y, angle, step=2, chunk=8, stats=None, layer=None):
+	'''sphere-traced version of march, using a distance_field of the track to jump over every sample
+	that cannot be in a wall and then testing the next chunk samples together. Stops on the same
+	sample as march, in a handful of lookups per ray'''
+
+	height, width = field.shape[-2:]
+	flat_field = field.ravel()
+
+	x = numpy.array(x, dtype=float).ravel()
+	y = numpy.array(y, dtype=float).ravel()
+	angle = numpy.broadcast_to(angle, x.shape)
+	step_x = step*numpy.sin(angle)
+	step_y = step*numpy.cos(angle)
+	base = numpy.zeros(x.size, dtype=int) if layer is None else numpy.broadcast_to(layer, x.shape)*height*width
+
+	# a point within d - sqrt(2) of one whose pixel is d from a wall cannot be in a wall pixel itself
+	margin = math.sqrt(2)
+
+	def safe_samples(clearance):
+		return numpy.floor(numpy.maximum(clearance - margin, 0)/step)
+
+	stop_x = numpy.empty_like(x)
+	stop_y = numpy.empty_like(y)
+	pixel = base + y.astype(int).clip(0, height-1)*width + x.astype(int).clip(0, width-1)
+	sample = safe_samples(flat_field[pixel])
+	live = numpy.arange(x.size)
+	offsets = numpy.arange(1, chunk+1)
+	if stats is not None:
+		stats.rays += x.size
+
+	while live.size:
+		if stats is not None:
+			stats.ray_steps += live.size*chunk
+		samples = sample[:,None] + offsets
+		test_x = x[:,None] + step_x[:,None]*samples
+		test_y = y[:,None] + step_y[:,None]*samples
+		pixel = base[:,None] + test_y.astype(int).clip(0, height-1)*width + test_x.astype(int).clip(0, width-1)
+		clearance = flat_field[pixel]
+		wall = (clearance == 0) | outside(test_x, test_y, width, height)
+
+		hit = wall.any(axis=1)
+		first = wall[hit].argmax(axis=1)
+		stop_x[live[hit]] = test_x[hit, first]
+		stop_y[live[hit]] = test_y[hit, first]
+
+		miss = ~hit
+		sample = samples[miss, -1] + safe_samples(clearance[miss, -1])
+		x, y = x[miss], y[miss]
+		step_x, step_y = step_x[miss], step_y[miss]
+		base = base[miss]
+		live = live[miss]
+
+	return stop_x, stop_y
+
+def sweep(field, x0, y0, x1, y1, radius, layer=None):
+	'''move circles of the given radius in straight lines from (x0, y0) towards (x1, y1), stopping each
+	at the last point, sampled at most a pixel apart, before it would move closer than radius to a wall by
+	the distance_field field. Returns the x and y each reached and a mask of those stopped short. Stretches
+	the field shows to be clear are jumped, so a sweep takes a few lookups, and a circle already touching
+	a wall can still move along or away from it. For a stack of fields, layer gives each one's field'''
+
+	height, width = field.shape[-2:]
+	flat_field = field.ravel()
+
+	x0 = numpy.array(x0, dtype=float).ravel()
+	y0 = numpy.array(y0, dtype=float).ravel()
+	dx = numpy.asarray(x1, dtype=float).ravel() - x0
+	dy = numpy.asarray(y1, dtype=float).ravel() - y0
+	length = numpy.hypot(dx, dy)
+	radius = numpy.broadcast_to(radius, x0.shape)
+	base = numpy.zeros(x0.size, dtype=int) if layer is None else numpy.broadcast_to(layer, x0.shape)*height*width
+	margin = math.sqrt(2)
+
+	def clearance(i, t):
+		# distance to spare between circles i, t pixels along their lines, and the walls
+		f = t/numpy.maximum(length[i], 1e-12)
+		x, y = x0[i] + dx[i]*f, y0[i] + dy[i]*f
+		return flat_field[base[i] + y.astype(int).clip(0, height-1)*width + x.astype(int).clip(0, width-1)] - radius[i]
+
+	travelled = numpy.zeros(x0.size)
+	stopped = numpy.zeros(x0.size, dtype=bool)
+	live = numpy.flatnonzero(length > 0)
+	spare = clearance(live, travelled[live])
+
+	while live.size:
+		t = numpy.minimum(travelled[live] + numpy.maximum(spare - margin, 1), length[live])
+		ahead = clearance(live, t)
+		hit = (ahead <= 0) & (ahead < spare)
+		stopped[live[hit]] = True
+
+		moved = ~hit
+		travelled[live[moved]] = t[moved]
+		going = moved & (t < length[live])
+		spare = ahead[going]
+		live = live[going]
+
+	f = numpy.where(length > 0, travelled/numpy.maximum(length, 1e-12), 1)
+	return x0 + dx*f, y0 + dy*f, stopped
+
+def sensors(track, x, y, heading, fov, field=None, stats=None, layer=None):
+	'''front, left and right wall distances for arrays of cars at (x, y) with the given heading
+	and fov (in degrees), as measured one car at a time by Environment.distances.
+	If the track's distance_field is given the rays are sphere traced rather than marched.
+	For a stack of tracks, layer gives the track each car is on'''
+
+	x = numpy.asarray(x, dtype=float)
+	y = numpy.asarray(y, dtype=float)
+	angle = math.pi - numpy.asarray(heading, dtype=float)
+	fov = numpy.asarray(fov, dtype=float)*math.pi/180
+
+	# front, left and right rays laid end to end
+	angles = numpy.concatenate(numpy.broadcast_arrays(angle, angle + fov, angle - fov))
+	x0 = numpy.tile(x, 3)
+	y0 = numpy.tile(y, 3)
+	if layer is not None:
+		layer = numpy.tile(numpy.broadcast_to(layer, x.shape), 3)
+	if field is None:
+		stop_x, stop_y = march(track, x0, y0, angles, stats=stats, layer=layer)
+	else:
+		stop_x, stop_y = trace(field, x0, y0, angles, stats=stats, layer=layer)
+
+	front, left, right = numpy.hypot(stop_x - x0, stop_y - y0).reshape(3, x.size)
+	return front, left, right
+
+def layers(control_rods, bias):
+	'''list of (control_rods, bias) pairs for a single or multi-layer network'''
+
+	if isinstance(control_rods, list):
+		return list(zip(control_rods, bias))
+	return [(control_rods, bias)]
+
+def network(control_rods, bias, inputs):
+	'''outputs of one car's network for the given inputs; hidden layers use tanh'''
+
+	network_layers = layers(control_rods, bias)
+	output = inputs
+	for i, (rods, layer_bias) in enumerate(network_layers):
+		output = dot(output, rods) + layer_bias
+		if i < len(network_layers) - 1:
+			output = numpy.tanh(output)
+	return output
+
+class Controller():
+	'''The networks of a whole population evaluated together: each layer holds an N x inputs x outputs
+	tensor of control rods and an N x outputs bias matrix, so a forward pass for every car is one
+	einsum per layer. Hidden layers use tanh, as in network()'''
+
+	def __init__(self, layers):
+		self.layers = layers
+
+	@classmethod
+	def from_particles(cls, particles):
+		networks = [layers(p.control_rods, p.bias) for p in particles]
+		shapes = set(tuple(rods.shape for rods, bias in network_layers) for network_layers in networks)
+		if len(shapes) > 1:
+			raise ValueError('every car in a population needs the same network shape, got ' + str(sorted(shapes)))
+
+		return cls([(numpy.array([n[k][0] for n in networks], dtype=float), numpy.array([n[k][1] for n in networks], dtype=float))
+			for k in range(len(networks[0]))])
+
+	def select(self, index):
+		return Controller([(rods[index], bias[index]) for rods, bias in self.layers])
+
+	def concatenate(self, other):
+		return Controller([(numpy.concatenate((rods, other_rods)), numpy.concatenate((bias, other_bias)))
+			for (rods, bias), (other_rods, other_bias) in zip(self.layers, other.layers)])
+
+	def network(self, i):
+		'''the control rods and bias of car i, in the form given to Particle'''
+
+		if len(self.layers) == 1:
+			rods, bias = self.layers[0]
+			return rods[i], bias[i]
+		return [rods[i] for rods, bias in self.layers], [bias[i] for rods, bias in self.layers]
+
+	def __call__(self, inputs):
+		'''outputs of every car's network, given an N x inputs matrix'''
+
+		output = inputs
+		for k, (rods, bias) in enumerate(self.layers):
+			output = numpy.einsum('ni,nij->nj', output, rods) + bias
+			if k < len(self.layers) - 1:
+				output = numpy.tanh(output)
+		return output
+
+def checkpoint_zones(shape, checkpoints, radius=40):
+	'''Label raster of the checkpoint zones: zones[y, x] numbers the set of checkpoints whose zone
+	the pixel at (x, y) may fall in, and members[zones[y, x], k] says whether checkpoint k is one of them.
+	A pixel is included if any point in it may be within radius of the checkpoint, so the raster
+	never misses a hit, but an exact distance test is still needed to confirm one'''
+
+	height, width = shape
+	zones = numpy.zeros(shape, dtype=numpy.int32)
+	members = [numpy.zeros(len(checkpoints), dtype=bool)]
+	reach = radius + math.sqrt(0.5)
+
+	for k, (cx, cy) in enumerate(checkpoints):
+		x0, x1 = max(int(cx - reach), 0), min(int(cx + reach) + 1, width)
+		y0, y1 = max(int(cy - reach), 0), min(int(cy + reach) + 1, height)
+		if x0 >= x1 or y0 >= y1:
+			continue
+		ys, xs = numpy.ogrid[y0:y1, x0:x1]
+		inside = (xs + 0.5 - cx)**2 + (ys + 0.5 - cy)**2 < reach**2
+
+		# every set of checkpoints already met in this zone becomes the same set plus checkpoint k
+		window = zones[y0:y1, x0:x1]
+		old, inverse = numpy.unique(window[inside], return_inverse=True)
+		for zone in old:
+			member = members[zone].copy()
+			member[k] = True
+			members.append(member)
+		window[inside] = len(members) - len(old) + inverse
+
+	members = numpy.array(members)
+	return zones.astype(numpy.min_scalar_type(len(members))), members
+
+def _save(path, data):
+	# write then rename, so that processes compiling the same track never see half a file
+	temporary = path + '.' + str(os.getpid()) + '.tmp'
+	with open(temporary, 'wb') as f:
+		numpy.save(f, data)
+	os.replace(temporary, path)
+
+def _load(path):
+	# a plain array view of the map, which indexes faster than a numpy.memmap object
+	return numpy.load(path, mmap_mode='r').view(numpy.ndarray)
+
+class CompiledTrack():
+	'''A track bitmap and the fields derived from it, identified by a hash of its contents.
+	track is 1 on the road and 0 on walls; field is its distance_field'''
+
+	def __init__(self, key, track, field, cache_dir=None):
+		self.key = key
+		self.track = track
+		self.field = field
+		self.cache_dir = cache_dir
+
+	def checkpoint_zones(self, checkpoints, radius=40):
+		'''checkpoint_zones for this track, cached beside the track under a hash of the checkpoints'''
+
+		if self.cache_dir is None:
+			return checkpoint_zones(self.track.shape, checkpoints, radius)
+
+		zone_key = hashlib.sha1(repr((list(map(tuple, checkpoints)), radius)).encode()).hexdigest()
+		paths = [os.path.join(self.cache_dir, self.key + '.' + name + '.' + zone_key + '.npy') for name in ('zones', 'members')]
+		if not all(os.path.exists(path) for path in paths):
+			for path, data in zip(paths, checkpoint_zones(self.track.shape, checkpoints, radius)):
+				_save(path, data)
+		return tuple(_load(path) for path in paths)
+
+	def clearance(self):
+		'''the distance field floored and capped at 255, one byte per pixel, cached beside the track.
+		It is 0 exactly on the walls, as every road pixel is at least 1 from a wall, and never more than
+		the true distance, so it can stand in for both the wall mask and the distance field'''
+
+		if self.cache_dir is None:
+			return numpy.minimum(self.field, 255).astype(numpy.uint8)
+
+		path = os.path.join(self.cache_dir, self.key + '.clearance.npy')
+		if not os.path.exists(path):
+			_save(path, numpy.minimum(self.field, 255).astype(numpy.uint8))
+		return _load(path)
+
+def compile_track(image, cache_dir=None):
+	'''Compile a track once and share it: image is the filename of a track image, whose road is
+	pure green, or an array that is 0 on walls. The wall mask (uint8) and its distance field (float32)
+	are saved as .npy files named after a hash of the contents, by default in a .track_cache
+	directory beside the image, and are memory mapped read-only on every later call, so
+	environments in other processes share the same pages rather than decoding the image again'''
+
+	if isinstance(image, CompiledTrack):
+		return image
+
+	if isinstance(image, str):
+		with open(image, 'rb') as f:
+			key = hashlib.sha1(f.read()).hexdigest()
+		if cache_dir is None:
+			cache_dir = os.path.join(os.path.dirname(os.path.abspath(image)), '.track_cache')
+	else:
+		image = numpy.ascontiguousarray(image)
+		key = hashlib.sha1(str(image.shape).encode() + (image != 0).tobytes()).hexdigest()
+		if cache_dir is None:
+			cache_dir = os.path.join(os.getcwd(), '.track_cache')
+
+	paths = dict((name, os.path.join(cache_dir, key + '.' + name + '.npy')) for name in ('track', 'field'))
+	if not all(os.path.exists(path) for path in paths.values()):
+		if isinstance(image, str):
+			# PIL is only needed to decode an image not yet compiled
+			from PIL import Image
+			track = (array(Image.open(image).convert('RGB'))[:,:,1] == 255).astype(numpy.uint8)
+		else:
+			track = (image != 0).astype(numpy.uint8)
+
+		os.makedirs(cache_dir, exist_ok=True)
+		_save(paths['track'], track)
+		_save(paths['field'], distance_field(track))
+
+	return CompiledTrack(key, _load(paths['track']), _load(paths['field']), cache_dir)
+
+def stack_tracks(tracks, compact=False):
+	'''the wall masks and distance fields of several CompiledTracks as two (tracks, height, width) arrays,
+	padded with wall to the largest of them. A single track is given as a view of its own arrays.
+	If compact, both are the same array, of each track's clearance'''
+
+	if compact:
+		layers = [(track.clearance(), track.clearance()) for track in tracks]
+	else:
+		layers = [(track.track, track.field) for track in tracks]
+	if len(layers) == 1:
+		return layers[0][0][None], layers[0][1][None]
+
+	height = max(mask.shape[0] for mask, field in layers)
+	width = max(mask.shape[1] for mask, field in layers)
+	track_stack = numpy.zeros((len(layers), height, width), dtype=layers[0][0].dtype)
+	field_stack = track_stack if compact else numpy.zeros((len(layers), height, width), dtype=numpy.float32)
+	for k, (mask, field) in enumerate(layers):
+		rows, cols = mask.shape
+		track_stack[k, :rows, :cols] = mask
+		field_stack[k, :rows, :cols] = field
+	return track_stack, field_stack
+
+class Culling():
+	'''When the batched step should stop simulating a car: once it has gone progress_ticks ticks
+	without passing a checkpoint, once it has moved slower than min_speed for stall_ticks ticks in a row,
+	or once it has driven laps laps. Culled cars are frozen with the score they had. Leave any
+	of these as None to not cull on it'''
+
+	def __init__(self, progress_ticks=None, min_speed=None, stall_ticks=None, laps=None):
+		self.progress_ticks = progress_ticks
+		self.min_speed = min_speed
+		self.stall_ticks = stall_ticks
+		self.laps = laps
+
+	def __call__(self, env, population):
+		'''mask of the cars in population to cull after this tick'''
+
+		p = population
+		cull = numpy.zeros(p.n, dtype=bool)
+		if self.progress_ticks is not None:
+			cull |= env.ticks - p.last_progress >= self.progress_ticks
+		if self.min_speed is not None and self.stall_ticks is not None:
+			p.stalled[:] = numpy.where(numpy.abs(p.speed) < self.min_speed, p.stalled + 1, 0)
+			cull |= p.stalled >= self.stall_ticks
+		if self.laps is not None:
+			cull |= p.checkpoints_passed >= self.laps*env.checkpoint_counts[p.track_id]
+		return cull
+
+class Stats():
+	'''Where an Environment's time goes: the wall time and number of calls of each phase of its ticks,
+	the ticks and car-ticks run, and how many rays the distance sensors cast and how many samples
+	they took. Set Environment.stats to one to start counting; while it is None nothing is measured'''
+
+	phases = ('control', 'move', 'bounce', 'track_bounce', 'collide', 'distances', 'update_score', 'culling')
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.time = dict.fromkeys(self.phases, 0.0)
+		self.calls = dict.fromkeys(self.phases, 0)
+		self.ticks = 0
+		self.car_ticks = 0
+		self.rays = 0
+		self.ray_steps = 0
+
+	def add(self, phase, seconds):
+		self.time[phase] += seconds
+		self.calls[phase] += 1
+
+	def summary(self):
+		'''the totals, and the mean per tick, as a dictionary'''
+
+		ticks = max(self.ticks, 1)
+		return {'ticks': self.ticks, 'car_ticks': self.car_ticks, 'rays': self.rays, 'ray_steps': self.ray_steps,
+			'steps_per_ray': self.ray_steps/max(self.rays, 1), 'seconds': sum(self.time.values()),
+			'phases': dict((phase, {'seconds': self.time[phase], 'calls': self.calls[phase], 'ms_per_tick': 1000*self.time[phase]/ticks})
+				for phase in self.phases)}
+
+	def __str__(self):
+		total = sum(self.time.values()) or 1
+		ticks = max(self.ticks, 1)
+		lines = [str(self.ticks)+' ticks, '+str(self.car_ticks)+' car-ticks, '+str(self.ray_steps)+' samples over '+str(self.rays)+' rays']
+		for phase in self.phases:
+			if self.calls[phase]:
+				lines.append('  %-13s %9.3f ms/tick %5.1f%% %9d calls' % (phase, 1000*self.time[phase]/ticks, 100*self.time[phase]/total, self.calls[phase]))
+		return '\n'.join(lines)
+
+class Leaderboard():
+	'''The k best cars of a population, best first, kept up to date between readings rather than found
+	by sorting every car each time. A car that gained points since the last reading can only have joined
+	the leaders, so only the leaders and those cars are ranked again; only when a leader loses points,
+	or cars are added, is the whole population searched afresh'''
+
+	def __init__(self, k=10):
+		self.k = k
+		self.reset()
+
+	def reset(self):
+		self.top = None
+		self.n = 0
+		self.raised = []
+
+	def gained(self, rows):
+		'''note that the cars in rows have gained points'''
+		if self.top is not None and len(rows):
+			self.raised.append(rows)
+
+	def lost(self, rows):
+		'''note that the cars in rows have lost points'''
+		if self.top is not None and len(rows) and numpy.isin(rows, self.top).any():
+			self.top = None
+
+	def leaders(self, scores, eligible=None):
+		'''rows of the k best of scores, best first and later rows first among equals,
+		counting only the rows eligible, a mask, picks out'''
+
+		if self.top is None or len(scores) != self.n:
+			candidates = numpy.arange(len(scores)) if eligible is None else numpy.flatnonzero(eligible)
+			if len(candidates) > self.k:
+				# keep every car tied with the kth best, so that the sort below picks the latest of them
+				kth = numpy.partition(scores[candidates], len(candidates) - self.k)[len(candidates) - self.k]
+				candidates = candidates[scores[candidates] >= kth]
+		else:
+			candidates = numpy.unique(numpy.concatenate([self.top] + self.raised))
+			if eligible is not None:
+				candidates = candidates[eligible[candidates]]
+
+		self.top = candidates[numpy.lexsort((-candidates, -scores[candidates]))][:self.k]
+		self.n = len(scores)
+		self.raised = []
+		return self.top
+
+class GenomeLayout():
+	'''Where each gene sits in a flat genome row: the control rods and bias of every network layer
+	in turn, then fov, then the three colour channels. shapes gives the control rods of each layer,
+	and dtype the type of the genomes made here (numpy.float32 halves their size)'''
+
+	def __init__(self, shapes=((5,4),), dtype=numpy.float64):
+		self.shapes = [tuple(shape) for shape in shapes]
+		self.dtype = numpy.dtype(dtype)
+		self.layers = []
+		start = 0
+		for n_in, n_out in self.shapes:
+			rods = slice(start, start + n_in*n_out)
+			bias = slice(rods.stop, rods.stop + n_out)
+			self.layers.append((rods, bias))
+			start = bias.stop
+
+		self.fov = start
+		self.colour = slice(start + 1, start + 4)
+		self.size = start + 4
+
+		# genes sharing a group are inherited together: every weight on its own, the colour as a whole
+		self.groups = numpy.concatenate((numpy.arange(start + 1), numpy.full(3, start + 1)))
+
+	@classmethod
+	def of(cls, particle):
+		'''the layout matching a particle's network'''
+		return cls([rods.shape for rods, bias in layers(particle.control_rods, particle.bias)])
+
+	def pack(self, control_rods, bias, fov, colour):
+		genome = numpy.empty(self.size, dtype=self.dtype)
+		for (rods_slice, bias_slice), (rods, layer_bias) in zip(self.layers, layers(control_rods, bias)):
+			genome[rods_slice] = numpy.ravel(rods)
+			genome[bias_slice] = layer_bias
+		genome[self.fov] = fov
+		genome[self.colour] = colour
+		return genome
+
+	def pack_particles(self, particles):
+		'''population matrix with one genome row per particle'''
+		return numpy.array([self.pack(p.control_rods, p.bias, p.fov, p.colour) for p in particles]).reshape(-1, self.size)
+
+	def unpack(self, genome):
+		'''control_rods, bias, fov and colour of one genome row, in the form given to Particle'''
+
+		control_rods = [genome[rods].reshape(shape) for (rods, bias), shape in zip(self.layers, self.shapes)]
+		bias = [genome[bias] for rods, bias in self.layers]
+		if len(self.layers) == 1:
+			control_rods, bias = control_rods[0], bias[0]
+		return control_rods, bias, genome[self.fov], tuple(int(c) for c in genome[self.colour])
+
+	def controller(self, genomes):
+		'''a Controller for the networks of every row of a population matrix'''
+		return Controller([(genomes[:, rods].reshape((-1,) + shape), genomes[:, bias]) for (rods, bias), shape in zip(self.layers, self.shapes)])
+
+	def random(self, n):
+		'''n new genomes, drawn as Particle draws its defaults'''
+
+		genomes = rand(n, self.size)
+		genomes[:, self.fov] = numpy.random.uniform(0, 90, n)
+		genomes[:, self.colour] = numpy.random.randint(0, 256, (n, 3))
+		return genomes.astype(self.dtype, copy=False)
+
+def breed_generation(parents, pairs, layout, variation=0.05, fov_variation=5, gaussian=False):
+	'''breed for a whole generation at once: child k takes each group of genes from parent pairs[k][0]
+	or pairs[k][1] of the parents population matrix with equal chance, as breed() does, and then every
+	weight and fov is mutated by up to variation and fov_variation (or with that standard deviation,
+	if gaussian). Colour is not mutated'''
+
+	pairs = numpy.asarray(pairs, dtype=int).reshape(-1, 2)
+	n = len(pairs)
+
+	coin = numpy.random.randint(0, 2, (n, layout.groups.max() + 1)).astype(bool)[:, layout.groups]
+	children = numpy.where(coin, parents[pairs[:,0]], parents[pairs[:,1]])
+
+	scale = numpy.zeros(layout.size)
+	scale[:layout.fov] = variation
+	scale[layout.fov] = fov_variation
+	if gaussian:
+		children += numpy.random.standard_normal(children.shape)*scale
+	else:
+		children += numpy.random.uniform(-1, 1, children.shape)*scale
+
+	return children
+
 class Particle():
+    # every attribute a particle may be given, so that none needs a __dict__
+    __slots__ = ('x', 'y', 'size', 'mass', 'thickness', 'speed', 'angle', 'elasticity', 'drag', 'wheel',
+        'distance_front', 'distance_right', 'distance_left', 'turning_angle', 'acceleration', 'brake',
+        'w', 'a', 's', 'd', 'control_rods', 'bias', 'fov', 'colour', 'score', 'checkpoints_passed',
+        'fastest_lap', 'stopwatch', 'name', 'track_id', 'heat', 'last_progress', 'stalled', 'active')
+
     def __init__(self, x, y, size, mass=1, **kargs):
         self.x = x
         self.y = y
@@ -141,7 +794,7 @@ class Particle():
         scaling = env.height/10
     
         inputs = [self.distance_left/scaling,self.distance_front/scaling,self.distance_right/scaling,self.speed,self.wheel]
-        output = dot(inputs,self.control_rods) + self.bias
+        output = network(self.control_rods, self.bias, inputs)
 
         threshold = 1
         if output[0] > threshold:
@@ -169,7 +822,7 @@ class Particle():
 
         next_checkpoint = env.checkpoints[(self.checkpoints_passed+1) % len(env.checkpoints)]
 
-        if math.hypot(self.x-next_checkpoint[0],self.y-next_checkpoint[1]) < 40:
+        if math.hypot(self.x-next_checkpoint[0],self.y-next_checkpoint[1]) < env.checkpoint_radius:
         	
         	self.checkpoints_passed += 1
         	self.score += (1000*self.checkpoints_passed/env.time_elapsed + 1)**2
@@ -184,19 +837,194 @@ class Particle():
 
        			self.stopwatch = env.time_elapsed
 
+class Population():
+	'''struct-of-arrays store holding the state of every car in an environment'''
+
+	# per-car state, grouped by the dtype of the array holding it
+	floats = ('x', 'y', 'mass', 'elasticity', 'drag', 'speed', 'angle', 'wheel', 'turning_angle', 'acceleration', 'brake', 'fov',
+		'distance_front', 'distance_right', 'distance_left', 'score', 'fastest_lap', 'stopwatch')
+	ints = ('size', 'checkpoints_passed', 'name', 'track_id', 'heat', 'last_progress', 'stalled')
+	flags = ('w', 'a', 's', 'd', 'active')
+
+	# state kept only by the batched step, and its starting values
+	defaults = {'track_id': 0, 'heat': 0, 'last_progress': 0, 'stalled': 0, 'active': True}
+
+	def __init__(self):
+		self.n = 0
+		for name in self.floats:
+			setattr(self, name, numpy.zeros(0))
+		for name in self.ints:
+			setattr(self, name, numpy.zeros(0, dtype=int))
+		for name in self.flags:
+			setattr(self, name, numpy.zeros(0, dtype=bool))
+		self.controller = None
+		self.colour = []
+
+	def append(self, n, controller, colour, **columns):
+		'''add n cars, each column of state given as n values or as one value for all of them'''
+
+		for name in self.floats + self.ints + self.flags:
+			column = getattr(self, name)
+			values = numpy.broadcast_to(numpy.asarray(columns.get(name, self.defaults.get(name)), dtype=column.dtype), (n,))
+			setattr(self, name, numpy.concatenate((column, values)))
+
+		self.controller = controller if self.n == 0 else self.controller.concatenate(controller)
+		self.colour.extend(colour)
+		self.n += n
+
+	def extend(self, particles):
+		'''copy the state of the given particles onto the end of the arrays'''
+
+		columns = dict((name, [getattr(p, name, self.defaults.get(name)) for p in particles]) for name in self.floats + self.ints + self.flags)
+		self.append(len(particles), Controller.from_particles(particles), [p.colour for p in particles], **columns)
+
+	def select(self, index):
+		'''a Population holding copies of the given rows, which scatter() can write back'''
+
+		selection = Population.__new__(Population)
+		for name in self.floats + self.ints + self.flags:
+			setattr(selection, name, getattr(self, name)[index])
+		selection.controller = None if self.controller is None else self.controller.select(index)
+		selection.colour = [self.colour[i] for i in index]
+		selection.n = len(index)
+		selection.index = index
+		return selection
+
+	def scatter(self, selection):
+		'''write the state of a selection back into the rows it was taken from'''
+
+		for name in self.floats + self.ints + self.flags:
+			getattr(self, name)[selection.index] = getattr(selection, name)
+
+class ParticleView():
+	'''a Particle whose state lives in one row of a Population. It behaves as a Particle, but holds
+	nothing besides its row, so that large populations do not need an object's worth of state per car'''
+
+	__slots__ = ('_population', '_index')
+	move = Particle.move
+	control = Particle.control
+	update_score = Particle.update_score
+
+	def __init__(self, population, index):
+		self._population = population
+		self._index = index
+
+	@property
+	def thickness(self):
+		return self.size
+
+	@property
+	def colour(self):
+		return self._population.colour[self._index]
+
+	@property
+	def control_rods(self):
+		return self._population.controller.network(self._index)[0]
+
+	@property
+	def bias(self):
+		return self._population.controller.network(self._index)[1]
+
+	def detach(self):
+		'''return a standalone Particle holding a copy of this car's state'''
+
+		particle = Particle.__new__(Particle)
+		for name in Population.floats + Population.ints + Population.flags:
+			setattr(particle, name, getattr(self, name))
+		particle.thickness = self.thickness
+		particle.colour = self.colour
+		control_rods, bias = self._population.controller.network(self._index)
+		if isinstance(control_rods, list):
+			particle.control_rods = [rods.copy() for rods in control_rods]
+			particle.bias = [layer_bias.copy() for layer_bias in bias]
+		else:
+			particle.control_rods = control_rods.copy()
+			particle.bias = bias.copy()
+		return particle
+
+	def __reduce__(self):
+		# pickle as a plain Particle so saved drivers do not drag the whole population along
+		particle = self.detach()
+		return (_restore_particle, (dict((name, getattr(particle, name)) for name in Particle.__slots__ if hasattr(particle, name)),))
+
+def _restore_particle(state):
+	particle = Particle.__new__(Particle)
+	for name, value in state.items():
+		setattr(particle, name, value)
+	return particle
+
+def _view_field(name):
+	def get(self):
+		return getattr(self._population, name)[self._index].item()
+	def set(self, value):
+		getattr(self._population, name)[self._index] = value
+	return property(get, set)
+
+for _name in Population.floats + Population.ints + Population.flags:
+	setattr(ParticleView, _name, _view_field(_name))
+
 class Environment:
 	
-	def __init__(self, size, image, checkpoints, colliding):
+	def __init__(self, size, image, checkpoints, colliding, vectorised=False, culling=None, compact=False):
 		self.width = size[0]
 		self.height = size[1]
 		self.particles = []
 		self.colour = (255,255,255)
 		self.elasticity = 0.15
-		self.track = array(Image.open(image))[:,:,1]/255
-		self.track = self.track.astype(int)
-		self.checkpoints = checkpoints
+
+		# a list of images, with a list of checkpoints for each, gives several tracks, which every
+		# particle's track_id chooses between. The first is the one the scalar update() drives on
+		if isinstance(image, (list, tuple)):
+			self.tracks = [compile_track(track_image) for track_image in image]
+			self.track_checkpoints = [list(points) for points in checkpoints]
+			if len(self.track_checkpoints) != len(self.tracks):
+				raise ValueError(str(len(self.tracks))+' tracks but '+str(len(self.track_checkpoints))+' lists of checkpoints')
+			if len(self.tracks) > 1 and not vectorised:
+				raise ValueError('several tracks can only be driven on by a vectorised Environment')
+		else:
+			self.tracks = [compile_track(image)]
+			self.track_checkpoints = [checkpoints]
+		self.compiled = self.tracks[0]
+		self.checkpoints = self.track_checkpoints[0]
+		self.checkpoint_counts = numpy.array([len(points) for points in self.track_checkpoints])
+
+		# a compact Environment keeps a single byte per pixel of track, its clearance, as both wall mask and distance field
+		self.compact = compact
+		if compact:
+			self.track = self.field = self.compiled.clearance()
+		else:
+			self.track = self.compiled.track
+			self.field = self.compiled.field
+		self.track_stack, self.field_stack = stack_tracks(self.tracks, compact)
+		self.checkpoint_radius = 40
+		self.zones = None
 		self.colliding = colliding
+		self.collision_rounds = 16
+
+		# the batched step moves cars on by timestep of the usual ticks at a time, in substeps stages each
+		# checked against the walls. Swept, a car stops where its path first meets a wall, found through the
+		# distance field, rather than being found inside it afterwards, so that it cannot pass through
+		self.timestep = 1
+		self.substeps = 1
+		self.swept = False
 		self.time_elapsed = 0
+		self.ticks = 0
+
+		# when vectorised, particles are packed into a Population and stepped together
+		self.vectorised = vectorised
+		self.population = Population()
+
+		# the batched step stops simulating particles this policy culls
+		self.culling = culling
+
+		# a Stats to time each phase of every tick in, or None
+		self.stats = None
+
+		# the leading cars of the batched step, overall and on each track, as they have been asked for
+		self.leaderboards = {}
+
+		# a traces.Trace recording chosen particles after every tick, or None
+		self.trace = None
 	
 	def addParticles(self, n=1, **kargs):
 		""" Add n particles with properties given by keyword arguments """
@@ -218,25 +1046,400 @@ class Environment:
 
 			particle = Particle(x, y, size, mass, accn=acceleration, turning_angle=turning_angle, control_rods=control_rods, bias=bias, fov=fov, colour=colour)
 			particle.speed = kargs.get('speed', random.random())
-			particle.angle = math.pi/4
+			particle.angle = kargs.get('angle', math.pi/4)
 			particle.drag = 0.95
 			particle.name = len(self.particles) + 1
+			particle.track_id = kargs.get('track_id', 0)
+			particle.heat = kargs.get('heat', 0)
 
 			self.particles.append(particle)
 
+	def addGenomes(self, genomes, layout, **kargs):
+		""" Add a particle for every row of a population matrix of genomes, with other properties
+		given by keyword arguments as for addParticles """
+
+		if not self.vectorised:
+			for genome in genomes:
+				control_rods, bias, fov, colour = layout.unpack(genome)
+				self.addParticles(1, control_rods=control_rods, bias=bias, fov=fov, colour=colour, **kargs)
+			return
+
+		population = self.pack()
+		start = population.n
+		n = len(genomes)
+
+		size = kargs.get('size', numpy.random.randint(10, 21, n))
+		acceleration = kargs.get('accn', 0.1)
+		population.append(n, layout.controller(genomes), [tuple(int(c) for c in colour) for colour in genomes[:, layout.colour]],
+			x=kargs.get('x', numpy.random.uniform(size, self.width - size, n)),
+			y=kargs.get('y', numpy.random.uniform(size, self.height - size, n)),
+			size=size, mass=size, elasticity=0.5, drag=0.95,
+			speed=kargs.get('speed', numpy.random.random(n)), angle=kargs.get('angle', math.pi/4), wheel=0,
+			turning_angle=kargs.get('turning_angle', 0.1), acceleration=acceleration, brake=-0.75*acceleration,
+			fov=genomes[:, layout.fov], distance_front=0, distance_right=0, distance_left=0,
+			score=0, fastest_lap=999999, stopwatch=0, checkpoints_passed=0, name=numpy.arange(start, start + n) + 1,
+			track_id=kargs.get('track_id', 0), heat=kargs.get('heat', 0), w=False, a=False, s=False, d=False)
+
+		self.particles.extend(ParticleView(population, i) for i in range(start, start + n))
+
 	def update(self):
 		'''Update the unique parameters of the particle'''
 		
+		if self.vectorised:
+			self.step()
+			self.ticks += 1
+			if self.trace is not None:
+				self.trace.record(self)
+			return
+
+		run = self.run
 		for i, particle in enumerate(self.particles):
-			particle.control(self)
-			particle.move()
-			self.bounce(particle)
-			self.track_bounce(particle)
+			run('control', particle.control, self)
+			run('move', particle.move)
+			run('bounce', self.bounce, particle)
+			run('track_bounce', self.track_bounce, particle)
 			if self.colliding:
-				for particle2 in self.particles[i+1:]:
-					collide(particle, particle2)
-			self.distances(particle)
-			particle.update_score(self)
+				run('collide', self.collide_with, i)
+			run('distances', self.distances, particle)
+			run('update_score', particle.update_score, self)
+		self.ticks += 1
+		if self.stats is not None:
+			self.stats.ticks += 1
+			self.stats.car_ticks += len(self.particles)
+		if self.trace is not None:
+			self.trace.record(self)
+
+	def run(self, phase, function, *args):
+		'''call function(*args), adding the time it took to phase if stats are being kept'''
+
+		if self.stats is None:
+			return function(*args)
+		start = time.perf_counter()
+		result = function(*args)
+		self.stats.add(phase, time.perf_counter() - start)
+		return result
+
+	def collide_with(self, i):
+		'''collide particle i with every particle after it'''
+
+		particle = self.particles[i]
+		for particle2 in self.particles[i+1:]:
+			collide(particle, particle2)
+
+	def advance(self, dt):
+		'''update() and then move the clock on by dt milliseconds, so that time_elapsed
+		depends on the number of ticks run rather than on the wall clock'''
+
+		self.update()
+		self.time_elapsed = self.ticks*dt
+
+	def pack(self):
+		'''move newly added particles into the population arrays, leaving views in their place'''
+
+		population = self.population
+		start = population.n
+		if start < len(self.particles):
+			population.extend(self.particles[start:])
+			self.particles[start:] = [ParticleView(population, i) for i in range(start, population.n)]
+
+		return population
+
+	def leaders(self, k=10, track_id=None):
+		'''the k particles with the highest scores, best first, from those on track track_id if given'''
+
+		particles = self.particles
+		if track_id is not None:
+			particles = [p for p in particles if p.track_id == track_id]
+		if not self.vectorised:
+			return sorted(particles, key=lambda particle:particle.score)[::-1][:k]
+
+		population = self.pack()
+		board = self.leaderboards.get(track_id)
+		if board is None or board.k < k:
+			board = self.leaderboards[track_id] = Leaderboard(k)
+		eligible = None if track_id is None else population.track_id == track_id
+		return [self.particles[i] for i in board.leaders(population.score, eligible)[:k]]
+
+	def rows(self, population, mask):
+		'''the rows of the whole population that mask picks out of population, which may be a selection of it'''
+		index = numpy.flatnonzero(mask)
+		return population.index[index] if hasattr(population, 'index') else index
+
+	@property
+	def done(self):
+		'''True once every particle has been culled, or when there are none'''
+		return not self.pack().active.any()
+
+	def step(self):
+		'''Advance every active particle by one tick using whole-population array operations.
+		Matches update() to floating point tolerance, except that collisions are resolved
+		after all the particles have moved rather than one particle at a time'''
+
+		population = self.pack()
+		if population.active.all():
+			active = population
+		else:
+			active = population.select(numpy.flatnonzero(population.active))
+		if active.n == 0:
+			return
+
+		run = self.run
+		run('control', self.batch_control, active)
+		self.batch_motion(active)
+		if self.colliding:
+			run('collide', self.batch_collide, active)
+		run('distances', self.batch_distances, active)
+		run('update_score', self.batch_update_score, active)
+		if self.culling is not None:
+			run('culling', self.batch_cull, active)
+
+		if active is not population:
+			population.scatter(active)
+		if self.stats is not None:
+			self.stats.ticks += 1
+			self.stats.car_ticks += active.n
+
+	def batch_motion(self, population):
+		'''move the population on by a tick and bounce it off the edges and walls, in substeps'''
+
+		run = self.run
+		for substep in range(self.substeps):
+			if self.swept:
+				start = population.x.copy(), population.y.copy()
+			run('move', self.batch_move, population, substep == 0)
+			run('bounce', self.batch_bounce, population)
+			if self.swept:
+				run('track_bounce', self.batch_sweep, population, *start)
+			else:
+				run('track_bounce', self.batch_track_bounce, population)
+
+	def batch_cull(self, population):
+		'''stop simulating the particles the culling policy picks out'''
+		population.active &= ~self.culling(self, population)
+
+	def batch_control(self, population):
+		'''Particle.control for the whole population'''
+
+		scaling = self.height/10
+		inputs = numpy.stack((population.distance_left/scaling, population.distance_front/scaling, population.distance_right/scaling,
+			population.speed, population.wheel), axis=1)
+		output = population.controller(inputs)
+
+		threshold = 1
+		population.w[:], population.a[:], population.s[:], population.d[:] = (output > threshold).T
+
+	def batch_move(self, population, accelerate=True):
+		'''Particle.move for the whole population, over timestep ticks, moving one substep of the way
+		and changing speed and heading only if accelerate'''
+
+		p = population
+		h = self.timestep
+		if accelerate:
+			p.speed[:] = p.speed*p.drag**h + p.acceleration*p.w*h + p.brake*p.s*h
+			p.wheel[:] = p.turning_angle*(p.d.astype(float) - p.a)
+			p.angle += p.wheel*h
+
+		distance = p.speed*(h/self.substeps)
+		p.x += numpy.sin(p.angle) * distance
+		p.y -= numpy.cos(p.angle) * distance
+
+	def batch_bounce(self, population):
+		'''bounce() for the whole population'''
+
+		p = population
+
+		hit = p.x > self.width - p.size
+		low = ~hit & (p.x < p.size)
+		p.x[hit] = 2*(self.width - p.size[hit]) - p.x[hit]
+		p.x[low] = 2*p.size[low] - p.x[low]
+		hit |= low
+		p.angle[hit] = - p.angle[hit]
+		p.speed[hit] *= self.elasticity
+
+		hit = p.y > self.height - p.size
+		low = ~hit & (p.y < p.size)
+		p.y[hit] = 2*(self.height - p.size[hit]) - p.y[hit]
+		p.y[low] = 2*p.size[low] - p.y[low]
+		hit |= low
+		p.angle[hit] = math.pi - p.angle[hit]
+		p.speed[hit] *= self.elasticity
+
+	def batch_track_bounce(self, population):
+		'''track_bounce() for the whole population'''
+
+		p = population
+		penalty = 0.25
+
+		# probe right, left, below and above the particle, in the same order as track_bounce
+		penalised = numpy.zeros(p.n, dtype=bool)
+		for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+			hit = self.track_stack[p.track_id, (p.y + dy*p.size).astype(int), (p.x + dx*p.size).astype(int)] == 0
+			p.x[hit] -= dx*p.size[hit]/2
+			p.y[hit] -= dy*p.size[hit]/2
+			p.score[hit] -= penalty
+			penalised |= hit
+			if Bounce:
+				p.speed[hit] *= self.elasticity
+				p.angle[hit] = - p.angle[hit] if dx else math.pi - p.angle[hit]
+			else:
+				p.speed[hit] *= -self.elasticity
+
+		if self.leaderboards and penalised.any():
+			rows = self.rows(p, penalised)
+			for board in self.leaderboards.values():
+				board.lost(rows)
+
+	def batch_sweep(self, population, x, y):
+		'''the swept alternative to batch_track_bounce: each particle that met a wall on its way from (x, y)
+		is stopped short of it, loses the same penalty and is bounced off it, its heading reflected about
+		the wall's normal, the slope of the distance field there'''
+
+		p = population
+		penalty = 0.25
+		p.x[:], p.y[:], hit = sweep(self.field_stack, x, y, p.x, p.y, p.size, p.track_id)
+		if not hit.any():
+			return
+
+		i = numpy.flatnonzero(hit)
+		height, width = self.field_stack.shape[-2:]
+		col, row, layer = p.x[i].astype(int).clip(1, width-2), p.y[i].astype(int).clip(1, height-2), p.track_id[i]
+		field = self.field_stack
+		normal_x = field[layer, row, col+1].astype(float) - field[layer, row, col-1]
+		normal_y = field[layer, row+1, col].astype(float) - field[layer, row-1, col]
+		norm = numpy.hypot(normal_x, normal_y)
+		normal_x, normal_y = normal_x/numpy.maximum(norm, 1e-12), normal_y/numpy.maximum(norm, 1e-12)
+
+		p.score[i] -= penalty
+		if Bounce:
+			# reflect the heading about the normal, or turn it round where there is none
+			heading_x, heading_y = numpy.sin(p.angle[i]), -numpy.cos(p.angle[i])
+			along = heading_x*normal_x + heading_y*normal_y
+			heading_x = numpy.where(norm > 0, heading_x - 2*along*normal_x, -heading_x)
+			heading_y = numpy.where(norm > 0, heading_y - 2*along*normal_y, -heading_y)
+			p.angle[i] = numpy.arctan2(heading_x, -heading_y)
+			p.speed[i] *= self.elasticity
+		else:
+			p.speed[i] *= -self.elasticity
+
+		if self.leaderboards:
+			rows = self.rows(p, hit)
+			for board in self.leaderboards.values():
+				board.lost(rows)
+
+	def batch_collide(self, population):
+		'''collide() for the pairs of particles that are touching, found through the collision_pairs
+		broad phase. The pairs are taken in rounds: each round resolves every remaining pair whose
+		particles appear in no earlier remaining pair, which gives the same result as colliding
+		them one at a time in order. Contacts made by this tick's pushes, and pile-ups needing
+		more than collision_rounds rounds, are left to be resolved next tick. Only particles on
+		the same track and in the same heat collide, so separate races can be run side by side'''
+
+		p = population
+		pairs = collision_pairs(p.x, p.y, p.size, p.track_id*(p.heat.max() + 1) + p.heat)
+		i, j = pairs.T
+		pairs = pairs[numpy.hypot(p.x[i] - p.x[j], p.y[i] - p.y[j]) < p.size[i] + p.size[j]]
+		first_pair = numpy.empty(p.n, dtype=int)
+
+		for _ in range(self.collision_rounds):
+			if not len(pairs):
+				break
+
+			# the first remaining pair each particle appears in
+			cars, first = numpy.unique(pairs.ravel(), return_index=True)
+			first_pair[cars] = first//2
+			index = numpy.arange(len(pairs))
+			now = (first_pair[pairs[:,0]] == index) & (first_pair[pairs[:,1]] == index)
+
+			i, j = pairs[now].T
+			touching = numpy.hypot(p.x[i] - p.x[j], p.y[i] - p.y[j]) < p.size[i] + p.size[j]
+			self.resolve_collisions(p, i[touching], j[touching])
+			pairs = pairs[~now]
+
+	def resolve_collisions(self, population, i, j):
+		'''collide() for touching pairs (i, j) in which no particle appears twice'''
+
+		p = population
+		dx = p.x[i] - p.x[j]
+		dy = p.y[i] - p.y[j]
+		dist = numpy.hypot(dx, dy)
+
+		angle = numpy.arctan2(dy, dx) + 0.5 * math.pi
+		mass1, mass2 = p.mass[i], p.mass[j]
+		total_mass = mass1 + mass2
+
+		p.angle[i], p.speed[i] = batch_add_vectors(p.angle[i], p.speed[i]*(mass1-mass2)/total_mass, angle, 2*p.speed[j]*mass2/total_mass)
+		p.angle[j], p.speed[j] = batch_add_vectors(p.angle[j], p.speed[j]*(mass2-mass1)/total_mass, angle+math.pi, 2*p.speed[i]*mass1/total_mass)
+		elasticity = p.elasticity[i] * p.elasticity[j]
+		p.speed[i] *= elasticity
+		p.speed[j] *= elasticity
+
+		overlap = 0.5*(p.size[i] + p.size[j] - dist+1)
+		p.x[i] += numpy.sin(angle)*overlap
+		p.y[i] -= numpy.cos(angle)*overlap
+		p.x[j] -= numpy.sin(angle)*overlap
+		p.y[j] += numpy.cos(angle)*overlap
+
+	def batch_distances(self, population):
+		'''distances() for the whole population'''
+
+		p = population
+		p.distance_front[:], p.distance_left[:], p.distance_right[:] = sensors(self.track_stack, p.x, p.y, p.angle, p.fov, self.field_stack, self.stats, p.track_id)
+
+	def batch_update_score(self, population):
+		'''Particle.update_score for the whole population. One lookup in the checkpoint zone raster
+		finds the few particles that may have reached their next checkpoint, and only those get
+		the exact distance test'''
+
+		p = population
+		if self.zones is None:
+			self.zones, self.zone_members, self.checkpoint_stack = self.stack_checkpoint_zones()
+		n_checkpoints = self.checkpoint_counts[p.track_id]
+
+		height, width = self.zones.shape[-2:]
+		zone = self.zones[p.track_id, p.y.astype(int).clip(0, height-1), p.x.astype(int).clip(0, width-1)]
+		next_index = (p.checkpoints_passed+1) % n_checkpoints
+		near = numpy.flatnonzero(self.zone_members[zone, next_index])
+
+		hit = numpy.zeros(p.n, dtype=bool)
+		next_checkpoint = self.checkpoint_stack[p.track_id[near], next_index[near]]
+		hit[near] = numpy.hypot(p.x[near] - next_checkpoint[:,0], p.y[near] - next_checkpoint[:,1]) < self.checkpoint_radius
+		p.checkpoints_passed[hit] += 1
+		p.last_progress[hit] = self.ticks
+		p.score[hit] += (1000*p.checkpoints_passed[hit]/self.time_elapsed + 1)**2
+		if self.leaderboards and hit.any():
+			rows = self.rows(p, hit)
+			for board in self.leaderboards.values():
+				board.gained(rows)
+
+		lap = self.time_elapsed - p.stopwatch
+		hit = ((p.checkpoints_passed+1) % n_checkpoints == 1) & (p.score > 0) & (lap > 5000) & (lap < p.fastest_lap)
+		for i in numpy.flatnonzero(hit):
+			print('Fastest lap! ' + str(round(lap[i].item()*100)/100000) + 's for particle ' + str(p.name[i]))
+		p.fastest_lap[hit] = lap[hit]
+		p.stopwatch[hit] = self.time_elapsed
+
+	def stack_checkpoint_zones(self):
+		'''the checkpoint zone rasters of every track, stacked like track_stack, with the sets of
+		checkpoints they number, and the checkpoints of every track padded to the longest list'''
+
+		rasters = [track.checkpoint_zones(points, self.checkpoint_radius) for track, points in zip(self.tracks, self.track_checkpoints)]
+		checkpoints = numpy.zeros((len(self.tracks), self.checkpoint_counts.max(), 2))
+		for k, points in enumerate(self.track_checkpoints):
+			checkpoints[k, :len(points)] = points
+		if len(rasters) == 1:
+			zones, members = rasters[0]
+			return zones[None], members, checkpoints
+
+		# number each track's zones after those of the tracks before it; zone 0 is empty on every track
+		zones = numpy.zeros(self.track_stack.shape, dtype=numpy.int32)
+		members = []
+		for k, (track_zones, track_members) in enumerate(rasters):
+			height, width = track_zones.shape
+			zones[k, :height, :width] = track_zones.astype(numpy.int32) + sum(len(m) for m in members)
+			padded = numpy.zeros((len(track_members), checkpoints.shape[1]), dtype=bool)
+			padded[:, :track_members.shape[1]] = track_members
+			members.append(padded)
+		return zones, numpy.concatenate(members), checkpoints
 
 	def bounce(self,particle):
 		''' check if (x,y) is off the screen, bounce off limits'''
@@ -317,15 +1520,20 @@ class Environment:
 			test = False
 			test_x = particle.x
 			test_y = particle.y
+			steps = 0
 
 			while test == False:
 				
 				test_x += 2*math.sin(angle)
 				test_y += 2*math.cos(angle)
+				steps += 1
 
 				if self.track[int(test_y),int(test_x)] == 0:
 					test = True
 
+			if self.stats is not None:
+				self.stats.rays += 1
+				self.stats.ray_steps += steps
 			return test_x,test_y
     	
 		test_x,test_y = calculation(self,particle,angle)
@@ -0,0 +1,149 @@
+# renderer.py
+# draws an Environment and its leaderboard with pygame, redrawing only what has changed
+
+import math, time
+import pygame
+
+# for ease, define colours here
+RED = (255,0,0)
+WHITE = (255,255,255)
+GREY = (230,230,230)
+BLACK = (0,0,0)
+
+class Renderer():
+	'''Draws the cars of an Environment over its track, with a top 10 leaderboard beside it.
+	Everything static (track, header, checkpoints and the leaderboard's plates) is drawn or rendered once,
+	and each frame only the rectangles that changed since the last one are redrawn and sent to the display.
+	Frames can be skipped, either a fixed frame_skip ticks at a time or to draw at most target_fps frames
+	a second, so that watching does not hold the simulation back. In an Environment of several tracks,
+	only the cars on track track_id are shown'''
+
+	leader_x = 800 + 75
+	rows = 10
+	row_height = 35
+
+	def __init__(self, screen, track, colour=WHITE, checkpoints=(), lines=False, frame_skip=0, target_fps=None, track_id=0):
+		self.screen = screen
+		self.track_id = track_id
+		self.lines = lines
+		self.frame_skip = frame_skip
+		self.target_fps = target_fps
+
+		self.font = pygame.font.Font(None, 32)
+
+		# the background: track, leaderboard header and checkpoints
+		self.background = pygame.Surface(screen.get_size())
+		self.background.fill(colour)
+		self.background.blit(pygame.image.load(track), (0,0))
+		header = self.font.render('LEADERBOARD', True, RED, WHITE)
+		self.background.blit(header, header.get_rect(center=(800+200, 40)))
+		for pos in checkpoints:
+			pygame.draw.circle(self.background, RED, pos, 5, 5)
+
+		# plates that never change, keyed by their text and whether they are lit
+		self.glyphs = {}
+		for i in range(self.rows):
+			self.glyphs[str(i+1)] = self.font.render(str(i+1), True, BLACK, WHITE)
+		for key in 'WASD':
+			self.glyphs[key, True] = self.font.render(key, True, BLACK, WHITE)
+			self.glyphs[key, False] = self.font.render(key, True, GREY, WHITE)
+
+		# names and scores, rendered as they first appear
+		self.text = {}
+
+		self.dirty = []
+		self.shown = False
+		self.ticks = 0
+		self.last_frame = None
+
+	def plate(self, string):
+		'''a rendered name or score, cached while it stays in use'''
+
+		if string not in self.text:
+			if len(self.text) > 1000:
+				self.text.clear()
+			self.text[string] = self.font.render(string, True, BLACK, WHITE)
+		return self.text[string]
+
+	def due(self):
+		'''count a tick, and say whether a frame should be drawn for it'''
+
+		self.ticks += 1
+		if self.frame_skip and (self.ticks - 1) % (self.frame_skip + 1):
+			return False
+		if self.target_fps and self.last_frame is not None and time.time() - self.last_frame < 1/self.target_fps:
+			return False
+		return True
+
+	def draw(self, env):
+		'''draw the current state of env if a frame is due, returning whether one was drawn'''
+
+		if not self.due():
+			return False
+		self.last_frame = time.time()
+
+		if not self.shown:
+			# the first frame puts the whole background on screen
+			self.screen.blit(self.background, (0,0))
+			updated = [self.screen.get_rect()]
+			self.shown = True
+		else:
+			updated = []
+
+		# rub out what was drawn last frame
+		for rect in self.dirty:
+			self.screen.blit(self.background, rect, rect)
+		updated += self.dirty
+		drawn = []
+
+		# draw cars and their lines, if requested
+		cars = self.cars(env)
+		for p in cars:
+			if self.lines:
+				angle = math.pi - p.angle
+				fov = p.fov*math.pi/180
+				start = (int(p.x), int(p.y))
+				for distance, direction in ((p.distance_front, angle), (p.distance_left, angle+fov), (p.distance_right, angle-fov)):
+					drawn.append(pygame.draw.line(self.screen, p.colour, start, (int(p.x)+distance*math.sin(direction),int(p.y)+distance*math.cos(direction))))
+			drawn.append(pygame.draw.circle(self.screen, p.colour, (int(p.x), int(p.y)), p.size, p.thickness))
+
+		drawn += self.draw_leaderboard(env.leaders(self.rows, self.track_id if len(env.tracks) > 1 else None))
+
+		updated += drawn
+		self.dirty = drawn
+		pygame.display.update(updated)
+		return True
+
+	def cars(self, env):
+		'''the particles of env on the track being drawn'''
+
+		if len(env.tracks) > 1:
+			return [p for p in env.particles if p.track_id == self.track_id]
+		return env.particles
+
+	def draw_leaderboard(self, leaders):
+		'''draw the rank, colour, name, score and controls of the leading cars, best first, returning the rows drawn'''
+
+		leader_x = self.leader_x
+		rows = []
+
+		for i, p in enumerate(leaders):
+			leader_y = 80 + i*self.row_height
+			row = pygame.Rect(leader_x - 30, leader_y - self.row_height//2, 300, self.row_height)
+			self.screen.blit(self.background, row, row)
+
+			self.screen.blit(self.glyphs[str(i+1)], self.glyphs[str(i+1)].get_rect(center=(leader_x - 10, leader_y)))
+			pygame.draw.circle(self.screen, p.colour, (leader_x + 20, leader_y), p.size, p.thickness)
+
+			nameplate = self.plate(str(p.name))
+			self.screen.blit(nameplate, nameplate.get_rect(midleft=(leader_x + 45, leader_y)))
+			scoreplate = self.plate(str(round(p.score,3)))
+			self.screen.blit(scoreplate, scoreplate.get_rect(midleft=(leader_x + 100, leader_y)))
+
+			for key, pressed, offset in (('W', p.w, 190), ('A', p.a, 212), ('S', p.s, 230), ('D', p.d, 250)):
+				glyph = self.glyphs[key, bool(pressed)]
+				self.screen.blit(glyph, glyph.get_rect(center=(leader_x + offset, leader_y)))
+
+			rows.append(row)
+
+		return rows
@@ -0,0 +1,133 @@
+# store.py
+# a compact file of every generation of a training run, for resuming it and racing its best drivers
+
+import os, random
+import numpy
+import pyparticles
+
+class GenomeStore():
+	'''An append-only file holding each generation of a training run: its genome rows, their scores and
+	the state of both random number generators once it had been scored. After a short header giving the
+	format version and the GenomeLayout of the genomes, each generation is one record: a fixed-size head
+	holding its population size and the random state, then its genomes and its scores as float64.
+	Generations are memory-mapped as they are read, so any one can be reached without loading the others'''
+
+	magic = b'ROBOCARS'
+	version = 1
+	head = numpy.dtype([('n', '<u8'),
+		('numpy_key', '<u4', 624), ('numpy_pos', '<i8'), ('numpy_gauss', '<f8', 2),
+		('random_key', '<u4', 624), ('random_pos', '<i8'), ('random_gauss', '<f8')])
+
+	def __init__(self, path, layout=None):
+		'''open the store at path, creating it for genomes of the given layout if there is none.
+		An existing store must hold genomes of the same layout, if one is given'''
+
+		self.path = path
+		if not os.path.exists(path):
+			if layout is None:
+				raise ValueError('no genome store at '+path+', and no layout to create one with')
+			self.write_header(layout)
+
+		with open(path, 'rb') as f:
+			if f.read(len(self.magic)) != self.magic:
+				raise ValueError(path+' is not a genome store')
+			version, n_layers = numpy.fromfile(f, '<u4', 2)
+			if version != self.version:
+				raise ValueError(path+' is a version '+str(version)+' genome store, this reads version '+str(self.version))
+			self.layout = pyparticles.GenomeLayout(numpy.fromfile(f, '<u4', 2*n_layers).reshape(-1, 2).tolist())
+
+		if layout is not None and layout.shapes != self.layout.shapes:
+			raise ValueError(path+' holds genomes of layers '+str(self.layout.shapes)+', not '+str(layout.shapes))
+		if layout is not None:
+			self.layout = layout
+
+		self.index()
+
+	@classmethod
+	def create(cls, path, layout):
+		'''a new, empty store at path, replacing any there already'''
+
+		if os.path.exists(path):
+			os.remove(path)
+		return cls(path, layout)
+
+	def write_header(self, layout):
+		header = numpy.array([self.version, len(layout.shapes)] + [k for shape in layout.shapes for k in shape], dtype='<u4')
+		with open(self.path, 'wb') as f:
+			f.write(self.magic + header.tobytes())
+			f.write(bytes(-f.tell() % 8))
+
+	def index(self):
+		'''find where each generation starts, ignoring a last record left half written'''
+
+		header = len(self.magic) + 4*(2 + 2*len(self.layout.shapes))
+		offset = header + -header % 8
+		size = os.path.getsize(self.path)
+
+		self.offsets = []
+		self.sizes = []
+		with open(self.path, 'rb') as f:
+			while offset + self.head.itemsize <= size:
+				f.seek(offset)
+				n = int(numpy.fromfile(f, self.head, 1)[0]['n'])
+				end = offset + self.head.itemsize + 8*n*(self.layout.size + 1)
+				if end > size:
+					break
+				self.offsets.append(offset)
+				self.sizes.append(n)
+				offset = end
+		self.end = offset
+
+	def __len__(self):
+		return len(self.offsets)
+
+	def append(self, genomes, scores):
+		'''save a scored generation, with the random state as it stands now'''
+
+		genomes = numpy.ascontiguousarray(genomes, dtype='<f8').reshape(-1, self.layout.size)
+		scores = numpy.ascontiguousarray(scores, dtype='<f8').reshape(-1)
+		if len(scores) != len(genomes):
+			raise ValueError(str(len(genomes))+' genomes but '+str(len(scores))+' scores')
+
+		head = numpy.zeros(1, self.head)
+		head['n'] = len(genomes)
+		name, head['numpy_key'], head['numpy_pos'], has_gauss, gauss = numpy.random.get_state()
+		head['numpy_gauss'] = has_gauss, gauss
+		version, key, gauss_next = random.getstate()
+		head['random_key'], head['random_pos'] = key[:-1], key[-1]
+		head['random_gauss'] = numpy.nan if gauss_next is None else gauss_next
+
+		with open(self.path, 'r+b') as f:
+			f.seek(self.end)
+			f.write(head.tobytes() + genomes.tobytes() + scores.tobytes())
+			f.truncate()
+			f.flush()
+			os.fsync(f.fileno())
+
+		self.offsets.append(self.end)
+		self.sizes.append(len(genomes))
+		self.end += self.head.itemsize + genomes.nbytes + scores.nbytes
+
+	def generation(self, g=-1):
+		'''the genomes and scores of generation g, mapped from the file, the genomes as the dtype of the layout
+		the store was opened with so that a run goes on as it would have without stopping'''
+
+		offset, n = self.offsets[g] + self.head.itemsize, self.sizes[g]
+		genomes = numpy.memmap(self.path, '<f8', 'r', offset, (n, self.layout.size)).view(numpy.ndarray).astype(self.layout.dtype, copy=False)
+		scores = numpy.memmap(self.path, '<f8', 'r', offset + 8*n*self.layout.size, (n,)).view(numpy.ndarray)
+		return genomes, scores
+
+	def restore(self, g=-1):
+		'''put both random number generators back as they were once generation g had been scored'''
+
+		head = numpy.memmap(self.path, self.head, 'r', self.offsets[g], (1,))[0]
+		numpy.random.set_state(('MT19937', numpy.array(head['numpy_key']), int(head['numpy_pos']), int(head['numpy_gauss'][0]), float(head['numpy_gauss'][1])))
+		gauss = float(head['random_gauss'])
+		random.setstate((3, tuple(int(k) for k in head['random_key']) + (int(head['random_pos']),), None if numpy.isnan(gauss) else gauss))
+
+	def best(self, k, g=-1):
+		'''the k best genomes of generation g and their scores, best first'''
+
+		genomes, scores = self.generation(g)
+		ranking = numpy.argsort(-scores, kind='stable')[:k]
+		return genomes[ranking], scores[ranking]
@@ -0,0 +1,28 @@
+# fixtures shared by the tests, run with python -m pytest
+
+import os, shutil, sys
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+@pytest.fixture(autouse=True)
+def working_directory(tmp_path, monkeypatch):
+	# tracks given as arrays are compiled into a .track_cache in the working directory, and the tests
+	# write their stores and traces there too
+	monkeypatch.chdir(tmp_path)
+
+@pytest.fixture
+def track(tmp_path):
+	'''a copy of the track image in tmp_path, which is compiled into a .track_cache beside it there'''
+
+	path = str(tmp_path/'track.bmp')
+	shutil.copy(os.path.join(root, 'track.bmp'), path)
+	return path
+
+@pytest.fixture
+def checkpoints():
+	'''the checkpoints of track, as gaming_assembly places them'''
+
+	import gaming_assembly
+	return list(gaming_assembly.checkpoints)
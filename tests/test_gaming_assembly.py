@@ -0,0 +1,22 @@
+# regression checks for gaming_assembly, run with python -m pytest
+
+import pytest
+import gaming_assembly
+
+def test_train_reproducible(track):
+	# a seeded run called in-process writes the same store every time
+	stores = []
+	for run in range(2):
+		path = 'drivers'+str(run)+'.gen'
+		gaming_assembly.train(track=track, headless=True, n_generations=2, generation_size=40, duration=3, seed=1, store_path=path)
+		stores.append(open(path, 'rb').read())
+	assert stores[0] == stores[1]
+
+@pytest.mark.parametrize('compact', (False, True))
+def test_resume_is_exact(track, compact):
+	# a run stopped and resumed from its store writes the same store as one that never stopped
+	settings = dict(track=track, headless=True, generation_size=40, duration=3, seed=1, compact=compact)
+	gaming_assembly.train(n_generations=3, store_path='whole.gen', **settings)
+	gaming_assembly.train(n_generations=2, store_path='resumed.gen', **settings)
+	gaming_assembly.train(n_generations=3, store_path='resumed.gen', resume=True, **settings)
+	assert open('resumed.gen', 'rb').read() == open('whole.gen', 'rb').read()
@@ -0,0 +1,151 @@
+# regression checks for pyparticles, run with python -m pytest
+
+import itertools, math, random, types
+import numpy
+import pyparticles
+
+def ring(road_width, shape=(400, 700), n_checkpoints=12):
+	'''a synthetic elliptical ring road with checkpoints spaced around it'''
+
+	rows, cols = shape
+	y, x = numpy.mgrid[0:rows, 0:cols]
+	a, b = (cols - 100)/2, (rows - 100)/2
+	dx, dy = (x - cols/2)/a, (y - rows/2)/b
+	r = numpy.hypot(dx, dy)
+	gradient = numpy.hypot(dx/a, dy/b)/numpy.maximum(r, 1e-9)
+	road = (abs(r - 1) < gradient*road_width/2) & (x > 30) & (x < cols - 30) & (y > 30) & (y < rows - 30)
+	angles = numpy.linspace(0, 2*math.pi, n_checkpoints, endpoint=False)
+	points = [(int(cols/2 + a*math.cos(t)), int(rows/2 + b*math.sin(t))) for t in angles]
+	return road.astype(numpy.uint8), points
+
+def test_stacked_checkpoint_zones():
+	# the first track has more zones than fit in a byte, the second few enough to be numbered in one
+	first, first_points = ring(60, n_checkpoints=150)
+	second, second_points = ring(40, n_checkpoints=12)
+	env = pyparticles.Environment((1200, 450), [first, second], [first_points, second_points], False, vectorised=True)
+	zones, members, checkpoints = env.stack_checkpoint_zones()
+
+	for k, (track, points) in enumerate(zip(env.tracks, env.track_checkpoints)):
+		own_zones, own_members = track.checkpoint_zones(points, env.checkpoint_radius)
+		height, width = own_zones.shape
+		stacked = members[zones[k, :height, :width]]
+		assert numpy.array_equal(stacked[..., :len(points)], own_members[own_zones])
+		assert not stacked[..., len(points):].any()
+	assert len(env.tracks[0].checkpoint_zones(first_points, env.checkpoint_radius)[1]) > 255
+	assert env.tracks[1].checkpoint_zones(second_points, env.checkpoint_radius)[0].dtype == numpy.uint8
+
+def test_batched_matches_scalar(track, checkpoints):
+	# the same random drivers stepped one particle at a time and all together end up in the same places
+	envs = []
+	for vectorised in (False, True):
+		random.seed(1)
+		numpy.random.seed(1)
+		env = pyparticles.Environment((1200,450), track, checkpoints, False, vectorised=vectorised)
+		env.addParticles(40, x=checkpoints[0][0], y=checkpoints[0][1], speed=0, size=5)
+		for t in range(300):
+			env.update()
+			env.time_elapsed = int(round((t + 1)*1000/60))
+		envs.append(env)
+
+	scalar, batched = envs
+	for name in ('x', 'y', 'speed', 'angle', 'score', 'checkpoints_passed', 'distance_front', 'distance_left', 'distance_right'):
+		expected = [getattr(p, name) for p in scalar.particles]
+		assert numpy.allclose([getattr(p, name) for p in batched.particles], expected, atol=1e-6), name
+
+def test_trace_matches_march(track):
+	# sphere tracing stops on the same sample as marching, on one track or a stack of them
+	track = pyparticles.compile_track(track).track
+	generator = numpy.random.default_rng(0)
+	road = numpy.argwhere(track)
+	y, x = road[generator.integers(len(road), size=2000)].T + generator.random((2, 2000))
+	angle = generator.uniform(-math.pi, math.pi, 2000)
+	marched = pyparticles.march(track, x, y, angle)
+	traced = pyparticles.trace(pyparticles.distance_field(track), x, y, angle)
+	assert numpy.allclose(traced, marched)
+
+	stack = numpy.stack([track, track[::-1]])
+	layer = generator.integers(2, size=2000)
+	y = numpy.where(layer, track.shape[0] - 1 - y, y)
+	field = numpy.stack([pyparticles.distance_field(layer_track) for layer_track in stack])
+	assert numpy.allclose(pyparticles.trace(field, x, y, angle, layer=layer), pyparticles.march(stack, x, y, angle, layer=layer))
+
+def test_leaderboard_ties():
+	# among equal scores the later rows lead, whether the leaders are found afresh or kept up to date
+	generator = numpy.random.default_rng(0)
+	scores = generator.integers(0, 5, 200).astype(float)
+	board = pyparticles.Leaderboard(10)
+	for reading in range(20):
+		expected = sorted(range(len(scores)), key=lambda i:(scores[i], i))[::-1][:10]
+		assert board.leaders(scores).tolist() == expected
+		raised = generator.choice(len(scores), 5, replace=False)
+		scores[raised] += generator.integers(0, 2, 5)
+		board.gained(raised)
+
+def test_rays_stop_at_the_edge():
+	# a ray leaving the image over road stops there, as if the image were walled in
+	track = numpy.ones((100, 200), numpy.uint8)
+	field = pyparticles.distance_field(track)
+	marched = pyparticles.sensors(track, [100.], [50.], [0.], [30.])
+	traced = pyparticles.sensors(track, [100.], [50.], [0.], [30.], field)
+	assert numpy.allclose(marched, traced)
+	x, y = pyparticles.march(track, [100.]*4, [50.]*4, [0, math.pi/2, math.pi, -math.pi/2])
+	assert numpy.all((x < 0) | (x >= 200) | (y < 0) | (y >= 100))
+	assert numpy.all((x > -3) & (x < 203) & (y > -3) & (y < 103))
+
+def test_collision_pairs_groups():
+	# particles in different groups are never paired, and within a group the pairs are as without groups
+	generator = numpy.random.default_rng(0)
+	x, y = generator.uniform(0, 60, (2, 300))
+	size = numpy.full(300, 5)
+	group = generator.integers(0, 30, 300)
+	pairs = pyparticles.collision_pairs(x, y, size, group)
+	assert (group[pairs[:,0]] == group[pairs[:,1]]).all()
+	everything = pyparticles.collision_pairs(x, y, size)
+	assert numpy.array_equal(pairs, everything[group[everything[:,0]] == group[everything[:,1]]])
+	assert len(pairs) < len(everything)/10
+
+def test_collision_rounds_match_collide():
+	# small clusters of cars far apart, each pair touching at the start resolved as collide() would in turn
+	generator = numpy.random.default_rng(0)
+	centres = numpy.stack(numpy.meshgrid(numpy.arange(50, 1000, 100), numpy.arange(50, 1000, 100)), -1).reshape(-1, 2)
+	counts = generator.integers(2, 6, len(centres))
+	x, y = (numpy.concatenate([centre + generator.uniform(-8, 8, count) for centre, count in zip(centres[:,k], counts)]) for k in (0, 1))
+	n = len(x)
+
+	env = pyparticles.Environment((1000,1000), numpy.ones((1000,1000), numpy.uint8), [(10,10),(20,20)], True, vectorised=True)
+	layout = pyparticles.GenomeLayout()
+	env.addGenomes(layout.random(n), layout, x=x, y=y, size=generator.integers(4, 8, n), speed=generator.uniform(0, 5, n), angle=generator.uniform(-3, 3, n))
+	population = env.pack()
+	population.mass[:] = generator.uniform(3, 10, n)
+	population.elasticity[:] = generator.uniform(0.5, 1, n)
+	names = ('x', 'y', 'size', 'mass', 'angle', 'speed', 'elasticity')
+	cars = [types.SimpleNamespace(**dict((name, float(getattr(population, name)[k])) for name in names)) for k in range(n)]
+
+	touching = [(a, b) for a, b in itertools.combinations(cars, 2) if math.hypot(a.x - b.x, a.y - b.y) < a.size + b.size]
+	for a, b in touching:
+		pyparticles.collide(a, b)
+	env.batch_collide(population)
+
+	assert len(touching) > 100
+	for name in ('x', 'y', 'angle', 'speed'):
+		assert numpy.allclose(getattr(population, name), [getattr(car, name) for car in cars], rtol=0, atol=1e-9), name
+
+def test_swept_cars_do_not_tunnel():
+	# cars driven fast at a wall two pixels thick pass through it unless their paths are swept
+	track = numpy.zeros((200, 400), numpy.uint8)
+	track[20:-20, 20:-20] = 1
+	track[20:-20, 199:201] = 0
+	layout = pyparticles.GenomeLayout()
+	crossed = []
+	for swept in (False, True):
+		env = pyparticles.Environment((400,200), track, [(100,100),(300,100)], False, vectorised=True)
+		env.swept = swept
+		env.addGenomes(layout.random(50), layout, x=numpy.full(50, 150.), y=numpy.linspace(40, 160, 50), speed=numpy.linspace(5, 40, 50), size=5)
+		population = env.pack()
+		population.angle[:], population.acceleration[:], population.brake[:], population.drag[:], population.turning_angle[:] = math.pi/2, 0, 0, 1, 0
+		for tick in range(30 if swept else 3):
+			env.advance(1000/60)
+		crossed.append(int((population.x > 200).sum()))
+	assert crossed[0] > 0
+	assert crossed[1] == 0
+	assert not (env.field[population.y.astype(int), population.x.astype(int)] == 0).any()
@@ -0,0 +1,17 @@
+# regression checks for store, run with python -m pytest
+
+import numpy
+import pyparticles
+import store
+
+def test_compact_generation():
+	# genomes come back as they went in, so a compact run resumes exactly
+	layout = pyparticles.GenomeLayout(dtype=numpy.float32)
+	genomes = layout.random(20)
+	drivers = store.GenomeStore.create('drivers.gen', layout)
+	drivers.append(genomes, numpy.arange(20.))
+
+	loaded, scores = store.GenomeStore('drivers.gen', layout).generation()
+	assert loaded.dtype == numpy.float32
+	assert loaded.tobytes() == genomes.tobytes()
+	assert store.GenomeStore('drivers.gen').generation()[0].dtype == numpy.float64
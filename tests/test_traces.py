@@ -0,0 +1,39 @@
+# regression checks for traces, run with python -m pytest
+
+import os
+import numpy
+import pyparticles
+import training
+import traces
+
+def recorded(track, checkpoints, ticks, capacity, n=40):
+	'''a trace of n random drivers racing on track for ticks ticks'''
+
+	layout = pyparticles.GenomeLayout()
+	pyparticles.seed(3)
+	env = training.environment(layout.random(n), layout, (1200,450), track, checkpoints)
+	env.trace = traces.Trace.create('race.trace', env, capacity=capacity, interval=30)
+	while env.ticks < ticks:
+		env.advance(1000/60)
+	env.trace.close(env)
+	return traces.Trace('race.trace')
+
+def test_replay_leaders(track, checkpoints):
+	# scores jump at every keyframe of a replay, so the leaders must be found afresh
+	trace = recorded(track, checkpoints, 600, 600)
+	env = pyparticles.Environment((1200,450), track, checkpoints, False, vectorised=True)
+	for tick in trace.replay(env, every=10):
+		scores = sorted(env.population.score)[::-1][:5]
+		assert [p.score for p in env.leaders(5)] == scores
+
+def test_trace_grows(track, checkpoints):
+	# a trace that fills is laid out again longer rather than dropping ticks
+	whole = recorded(track, checkpoints, 600, 600)
+	controls, times, keyframes, last = (numpy.array(section) for section in (whole.controls, whole.times, whole.keyframes, whole.last))
+	grown = recorded(track, checkpoints, 600, 100)
+	assert len(grown) == 600 and grown.capacity >= 600
+	assert not os.path.exists('race.trace.grown')
+	assert numpy.array_equal(grown.controls[:600], controls)
+	assert numpy.array_equal(grown.times[:600], times)
+	assert numpy.array_equal(grown.keyframes[:len(keyframes)], keyframes)
+	assert numpy.array_equal(grown.last, last)
@@ -0,0 +1,91 @@
+# regression checks for training, run with python -m pytest
+
+import numpy
+import pyparticles
+import training
+
+def test_next_generation_size():
+	# a small island breeds no more than it keeps, however many it pairs off
+	layout = pyparticles.GenomeLayout()
+	genomes = layout.random(30)
+	scores = numpy.random.random(30)
+	for generation in range(3):
+		genomes = training.next_generation(genomes, scores, layout, 30, n_to_keep=10)
+		assert len(genomes) == 30
+
+def test_next_generation_elites():
+	# the elites take the places of children rather than being added to them
+	layout = pyparticles.GenomeLayout()
+	genomes = layout.random(300)
+	scores = numpy.random.random(300)
+	generation = training.next_generation(genomes, scores, layout, 300, elites=5)
+	assert len(generation) == 300
+	assert numpy.array_equal(generation[:5], genomes[numpy.argsort(-scores)[:5]])
+
+def test_timestep_keeps_simulated_time(track, checkpoints):
+	# longer ticks are fewer, so drivers score about the same whatever the timestep
+	layout = pyparticles.GenomeLayout()
+	pyparticles.seed(2)
+	genomes = layout.random(40)
+	best = [numpy.sort(training.evaluate(genomes, layout, (1200,450), track, checkpoints, 600, 1000/60, timestep=timestep))[-10:].mean()
+		for timestep in (1, 2)]
+	assert abs(best[1]/best[0] - 1) < 0.1
+
+def test_fitness_cache_counts_copies():
+	# copies of a genome missing from the cache are driven once, the rest counted as hits
+	layout = pyparticles.GenomeLayout()
+	genomes = layout.random(64)
+	genomes = numpy.concatenate((genomes, genomes[:10]))
+	driven = []
+	cache = training.FitnessCache(100, layout)
+	scores = cache(genomes, lambda genomes: driven.append(len(genomes)) or genomes[:, 0])
+	assert driven == [64]
+	assert numpy.array_equal(scores, genomes[:, 0])
+	assert (cache.hits, cache.misses) == (10, 64)
+
+def test_island_model_keeps_elites_and_dtype(track, checkpoints):
+	# each island carries its best genomes over unchanged, in the layout's dtype
+	layout = pyparticles.GenomeLayout(dtype=numpy.float32)
+	model = training.IslandModel(2, 20, layout, migration_interval=5, n_to_keep=5, elites=2, seed=1,
+		size=(1200,450), image=track, checkpoints=checkpoints, ticks=120, dt=1000/60)
+	generations = []
+	model.run(2, layout.random(40), lambda generation, genomes, scores: generations.append((genomes, scores)))
+	(first, scores), (second, _) = generations
+	assert first.dtype == second.dtype == numpy.float32
+	assert len(second) == 40
+	for island in range(2):
+		rows = slice(20*island, 20*(island + 1))
+		best = first[rows][sorted(range(20), key=lambda i:scores[rows][i])[::-1][:2]]
+		assert numpy.array_equal(second[rows][:2], best)
+
+def test_fitness_cache_evicts_least_recently_used(track, checkpoints):
+	# a full cache forgets the genomes used longest ago, and what it remembers is what evaluate gives
+	layout = pyparticles.GenomeLayout()
+	pyparticles.seed(4)
+	genomes = layout.random(10)
+	evaluate = lambda genomes: training.evaluate(genomes, layout, (1200,450), track, checkpoints, 300, 1000/60)
+	cache = training.FitnessCache(8, layout, context=(track, checkpoints, 300))
+
+	first = cache(genomes, evaluate)
+	assert (cache.hits, cache.misses) == (0, 10)
+	cache.reset_counts()
+	second = cache(genomes, evaluate)
+	assert (cache.hits, cache.misses) == (8, 2)
+	assert numpy.array_equal(first, second)
+	assert numpy.array_equal(second, evaluate(genomes))
+
+	# rows 0 and 1 came back last, pushing out rows 2 and 3
+	cache.reset_counts()
+	cache(genomes[[0, 1, 2, 3]], evaluate)
+	assert (cache.hits, cache.misses) == (2, 2)
+
+def test_parallel_evaluator_matches_evaluate(track, checkpoints):
+	# without collisions a car's score depends only on its genome, so sharding changes nothing
+	layout = pyparticles.GenomeLayout()
+	pyparticles.seed(5)
+	genomes = layout.random(30)
+	settings = dict(layout=layout, size=(1200,450), image=track, checkpoints=checkpoints, ticks=300, dt=1000/60,
+		culling=pyparticles.Culling(progress_ticks=120))
+	with training.ParallelEvaluator(3, seed=1, **settings) as evaluator:
+		scores = evaluator(genomes)
+	assert numpy.array_equal(scores, training.evaluate(genomes, **settings))
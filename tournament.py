@@ -0,0 +1,127 @@
+# tournament.py
+# ranks many drivers by racing them against each other headless, in heats drawn at random
+
+import concurrent.futures, math
+import numpy
+import pyparticles
+
+def starting_grid(env, n, track_id=0, spacing=15, car_size=5):
+	'''n slots for cars of car_size on track track_id of env, in pairs side by side spacing apart, lined
+	up behind its first checkpoint and facing its second, pole first. Slots too near a wall are passed
+	over. Returns the x and y of the slots and the heading to start at'''
+
+	(x0, y0), (x1, y1) = env.track_checkpoints[track_id][:2]
+	heading = math.atan2(x1 - x0, y0 - y1)
+	forward_x, forward_y = math.sin(heading), -math.cos(heading)
+	field = env.field_stack[track_id]
+	height, width = field.shape
+
+	slots = []
+	row = 0
+	while len(slots) < n:
+		if row*spacing > width + height:
+			raise ValueError('no room behind the first checkpoint for a grid of '+str(n)+' cars')
+		for side in (-0.5, 0.5):
+			x = x0 - forward_x*row*spacing - forward_y*side*spacing
+			y = y0 - forward_y*row*spacing + forward_x*side*spacing
+			if 0 <= x < width and 0 <= y < height and field[int(y), int(x)] > car_size + 1:
+				slots.append((x, y))
+		row += 1
+
+	x, y = numpy.array(slots[:n]).T
+	return x, y, heading
+
+def draw(n, grid_size, generator):
+	'''a random draw of n drivers into heats of grid_size, the last heats a car short if need be,
+	as a list of arrays of their rows'''
+
+	heats = math.ceil(n/grid_size)
+	return numpy.array_split(generator.permutation(n), heats)
+
+def race(genomes, layout, heats, size, image, checkpoints, ticks, dt, car_size=5, culling=None, compact=False,
+		timestep=1, substeps=1, swept=False):
+	'''race every heat, each an array of rows of a population matrix of genomes, from a standing start on
+	the starting_grid, for a fixed number of ticks of dt milliseconds, each tick of the Environment standing for
+	timestep of them as in training.evaluate. The heats are run side by side in one colliding Environment, cars
+	only meeting those in their own heat. Returns the scores of each heat'''
+
+	env = pyparticles.Environment(size, image=image, checkpoints=checkpoints, colliding=True, vectorised=True, culling=culling, compact=compact)
+	env.timestep, env.substeps, env.swept = timestep, substeps, swept
+	x, y, heading = starting_grid(env, max(len(rows) for rows in heats), spacing=3*car_size, car_size=car_size)
+	for heat, rows in enumerate(heats):
+		env.addGenomes(genomes[rows], layout, x=x[:len(rows)], y=y[:len(rows)], angle=heading, speed=0, size=car_size, heat=heat)
+
+	while env.ticks < ticks/timestep and not env.done:
+		env.advance(dt*timestep)
+
+	scores = env.pack().score
+	return numpy.split(scores, numpy.cumsum([len(rows) for rows in heats])[:-1])
+
+class Ranking():
+	'''Elo ratings and championship points of n drivers, built up race by race. Every race counts as a
+	match between each pair of its drivers, the one with the higher score winning, worth k/(cars - 1)
+	rating points; the first ten home also get points by position, as in a championship'''
+
+	positions = (25, 18, 15, 12, 10, 8, 6, 4, 2, 1)
+
+	def __init__(self, n, rating=1500, k=32):
+		self.k = k
+		self.ratings = numpy.full(n, float(rating))
+		self.points = numpy.zeros(n, dtype=int)
+		self.wins = numpy.zeros(n, dtype=int)
+		self.races = numpy.zeros(n, dtype=int)
+
+	def add(self, drivers, scores):
+		'''count a race between the given drivers, which scored scores'''
+
+		drivers = numpy.asarray(drivers)
+		scores = numpy.asarray(scores)
+		finish = drivers[numpy.argsort(-scores, kind='stable')]
+		self.points[finish[:len(self.positions)]] += self.positions[:len(finish)]
+		self.wins[finish[0]] += 1
+		self.races[drivers] += 1
+		if len(drivers) < 2:
+			return
+
+		rating = self.ratings[drivers]
+		expected = 1/(1 + 10**((rating[None,:] - rating[:,None])/400))
+		actual = (scores[:,None] > scores[None,:]) + 0.5*(scores[:,None] == scores[None,:])
+		numpy.fill_diagonal(expected, 0)
+		numpy.fill_diagonal(actual, 0)
+		self.ratings[drivers] += self.k/(len(drivers) - 1)*(actual - expected).sum(axis=1)
+
+	def order(self):
+		'''the drivers, best rated first'''
+		return numpy.argsort(-self.ratings, kind='stable')
+
+def run(genomes, layout, rounds, grid_size=10, workers=0, seed=0, ranking=None, **settings):
+	'''rank every row of a population matrix of genomes over rounds rounds, each a fresh draw of them into
+	heats of grid_size raced by race(), with the given settings. Rounds are raced on a pool of workers
+	processes if any, but counted in order, so the ranking depends only on seed. Returns the Ranking'''
+
+	if ranking is None:
+		ranking = Ranking(len(genomes))
+	draws = [draw(len(genomes), grid_size, numpy.random.default_rng((seed, r))) for r in range(rounds)]
+
+	if workers:
+		with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+			results = [pool.submit(race, genomes, layout, heats, **settings) for heats in draws]
+			results = [result.result() for result in results]
+	else:
+		results = (race(genomes, layout, heats, **settings) for heats in draws)
+
+	for heats, scores in zip(draws, results):
+		for rows, heat_scores in zip(heats, scores):
+			ranking.add(rows, heat_scores)
+	return ranking
+
+def entrants(drivers, k, generations=(-1,)):
+	'''the best k genomes of each of the given generations of a GenomeStore, together, with the generation
+	and place within it of each'''
+
+	genomes, labels = [], []
+	for g in generations:
+		best, scores = drivers.best(k, g)
+		genomes.append(best)
+		labels += [(g % len(drivers), place) for place in range(len(best))]
+	return numpy.concatenate(genomes), labels
@@ -0,0 +1,251 @@
+# traces.py
+# compact recordings of what chosen cars did each tick, for replaying laps and races without re-running their drivers
+
+import os
+import numpy
+import pyparticles
+
+# the bits of a car's byte for each tick: the keys it pressed, and whether it had been culled
+W, A, S, D, CULLED = 1, 2, 4, 8, 16
+
+class Trace():
+	'''A file recording chosen cars of an Environment tick by tick: one byte per car per tick holding
+	the w/a/s/d keys it pressed, the time of every tick, and every interval ticks a keyframe of each car's
+	position, motion and score. Set it as Environment.trace to record. A replay re-integrates the cars'
+	motion from the keys alone, without sensing or control, starting from the nearest keyframe, so any
+	tick can be reached quickly and a race played back many times faster than it was run. The file is
+	laid out with room for a capacity of ticks and memory-mapped, so opening it reads nothing'''
+
+	magic = b'ROBOTRAC'
+	version = 1
+	car = numpy.dtype([('name', '<i8'), ('track_id', '<i8'), ('size', '<i8'), ('colour', '<i8', 3), ('mass', '<f8'), ('elasticity', '<f8'),
+		('drag', '<f8'), ('turning_angle', '<f8'), ('acceleration', '<f8'), ('brake', '<f8'), ('fov', '<f8')])
+	keyframe = numpy.dtype([('x', '<f8'), ('y', '<f8'), ('speed', '<f8'), ('angle', '<f8'), ('score', '<f8'),
+		('fastest_lap', '<f8'), ('stopwatch', '<f8'), ('checkpoints_passed', '<i8')])
+	header = numpy.dtype([('magic', 'S8'), ('version', '<u4'), ('cars', '<u4'), ('interval', '<u4'), ('capacity', '<u4'), ('ticks', '<u8')])
+	names = ('cars', 'times', 'controls', 'keyframes', 'last')
+
+	def __init__(self, path, mode='r'):
+		'''open the trace at path, read only unless mode is 'r+\''''
+
+		self.path = path
+		header = numpy.fromfile(path, self.header, 1)
+		if not len(header) or header[0]['magic'] != self.magic:
+			raise ValueError(path+' is not a trace')
+		if header[0]['version'] != self.version:
+			raise ValueError(path+' is a version '+str(header[0]['version'])+' trace, this reads version '+str(self.version))
+
+		self.head = numpy.memmap(path, self.header, mode, 0, (1,))
+		cars, interval, capacity = (int(self.head[0][name]) for name in ('cars', 'interval', 'capacity'))
+		self.interval = interval
+		self.capacity = capacity
+
+		offset = self.header.itemsize
+		sections = {}
+		for name, dtype, shape in self.sections(cars, interval, capacity):
+			sections[name] = numpy.memmap(path, dtype, mode, offset, shape)
+			size = numpy.dtype(dtype).itemsize*int(numpy.prod(shape))
+			offset += size + -size % 8
+		self.cars = sections['cars']
+		self.times = sections['times']
+		self.controls = sections['controls']
+		self.keyframes = sections['keyframes']
+		self.last = sections['last']
+		self.rows = None
+
+	@classmethod
+	def sections(cls, cars, interval, capacity):
+		# what follows the header, in order
+		return (('cars', cls.car, (cars,)), ('times', '<f8', (capacity,)), ('controls', 'u1', (capacity, cars)),
+			('keyframes', cls.keyframe, (capacity//interval + 1, cars)), ('last', cls.keyframe, (cars,)))
+
+	@classmethod
+	def create(cls, path, env, cars=None, capacity=36000, interval=60):
+		'''a new trace at path, replacing any there already, ready to record the particles of env
+		at the indices cars (all of them if None), with room for capacity ticks from now, and a keyframe
+		every interval ticks. The file is laid out again twice as long whenever it fills'''
+
+		if env.vectorised:
+			env.pack()
+		rows = numpy.arange(len(env.particles)) if cars is None else numpy.asarray(cars, dtype=int)
+		cls.lay_out(path, len(rows), interval, capacity)
+
+		trace = cls(path, 'r+')
+		trace.rows = rows
+		particles = [env.particles[i] for i in rows]
+		for name in cls.car.names:
+			trace.cars[name] = [getattr(p, name) for p in particles]
+		trace.keyframes[0] = trace.state(env)
+		return trace
+
+	@classmethod
+	def lay_out(cls, path, cars, interval, capacity, ticks=0):
+		# write a header and leave room after it for the sections, replacing anything at path
+		size = cls.header.itemsize
+		for name, dtype, shape in cls.sections(cars, interval, capacity):
+			nbytes = numpy.dtype(dtype).itemsize*int(numpy.prod(shape))
+			size += nbytes + -nbytes % 8
+		header = numpy.zeros(1, cls.header)
+		header[0] = (cls.magic, cls.version, cars, interval, capacity, ticks)
+		with open(path, 'wb') as f:
+			f.write(header.tobytes())
+			f.truncate(size)
+
+	def grow(self):
+		'''lay the file out again with room for twice as many ticks, keeping all that has been recorded.
+		The longer file is written beside this one and swapped in once neither is mapped any more, as a
+		mapped file cannot be truncated or replaced everywhere'''
+
+		grown_path = self.path + '.grown'
+		self.lay_out(grown_path, len(self.cars), self.interval, max(2*self.capacity, self.interval), len(self))
+		grown = Trace(grown_path, 'r+')
+		for name in self.names:
+			section = getattr(self, name)
+			getattr(grown, name)[:len(section)] = section
+		grown.release()
+		self.release()
+
+		os.replace(grown_path, self.path)
+		rows = self.rows
+		self.__init__(self.path, 'r+')
+		self.rows = rows
+
+	def release(self):
+		# write everything out and drop the maps of the file
+		self.flush()
+		self.head = None
+		for name in self.names:
+			setattr(self, name, None)
+
+	def __len__(self):
+		'''the number of ticks recorded'''
+		return int(self.head[0]['ticks'])
+
+	def column(self, env, name):
+		'''the given state of every car being recorded'''
+
+		if env.vectorised:
+			return getattr(env.population, name)[self.rows]
+		return numpy.array([getattr(env.particles[i], name) for i in self.rows])
+
+	def state(self, env):
+		'''a keyframe of the cars being recorded'''
+
+		state = numpy.zeros(len(self.rows), self.keyframe)
+		for name in self.keyframe.names:
+			state[name] = self.column(env, name)
+		return state
+
+	def record(self, env):
+		'''save the tick env has just run, called by it after every tick'''
+
+		t = len(self)
+		if t >= self.capacity:
+			self.grow()
+
+		column = self.column
+		keys = column(env, 'w')*W | column(env, 'a')*A | column(env, 's')*S | column(env, 'd')*D
+		if env.vectorised:
+			keys |= ~column(env, 'active')*CULLED
+		self.controls[t] = keys
+		self.times[t] = env.time_elapsed
+		if (t + 1) % self.interval == 0:
+			self.keyframes[(t + 1)//self.interval] = self.state(env)
+		self.head[0]['ticks'] = t + 1
+
+	def close(self, env):
+		'''save the latest state of the cars being recorded from env, so that fastest laps completed
+		since the last keyframe are found, and write everything out'''
+
+		self.last[:] = self.state(env)
+		self.flush()
+
+	def flush(self):
+		self.head.flush()
+		for name in self.names:
+			getattr(self, name).flush()
+
+	def replay(self, env, start=0, stop=None, every=1):
+		'''put the recorded cars into env, a vectorised Environment with no particles of its own, on the
+		same tracks and with the same timestep, substeps and sweeping as the one recorded, as they were after
+		start ticks. Then move them on by their recorded keys, yielding every every ticks up to and including
+		stop (the last recorded tick if None) the number of ticks they have been moved to. If the cars
+		collided with others that were not recorded, the replay drifts from the race until the next keyframe'''
+
+		stop = len(self) if stop is None else min(stop, len(self))
+		tick = min(start, stop)
+		keyframe = tick//self.interval
+		self.load(env, self.keyframes[keyframe])
+		population = env.population
+		t = keyframe*self.interval
+
+		while True:
+			if t == tick:
+				yield t
+				tick += every
+				if tick > stop:
+					return
+				if tick//self.interval > t//self.interval:
+					# skip ahead to the keyframe before the next tick wanted
+					t = tick//self.interval*self.interval
+					self.set(env, self.keyframes[t//self.interval])
+					continue
+
+			# cars culled by the end of the tick before are frozen
+			controls = self.controls[t]
+			population.w[:], population.a[:], population.s[:], population.d[:] = (controls[:, None] & [W, A, S, D]).astype(bool).T
+			population.active[:] = t == 0 or ~(self.controls[t - 1] & CULLED).astype(bool)
+			env.ticks = t
+			env.time_elapsed = self.times[t]
+			self.move(env, population)
+			t += 1
+			if t % self.interval == 0:
+				self.set(env, self.keyframes[t//self.interval])
+
+	def seek(self, env, tick):
+		'''put the recorded cars into env as they were after tick ticks'''
+		return next(self.replay(env, tick, tick))
+
+	def load(self, env, state):
+		# replace env's particles with the recorded cars in the given state
+		cars = self.cars
+		population = pyparticles.Population()
+		n = len(cars)
+		population.append(n, None, [tuple(int(c) for c in colour) for colour in cars['colour']],
+			size=cars['size'], mass=cars['mass'], elasticity=cars['elasticity'], drag=cars['drag'], turning_angle=cars['turning_angle'],
+			acceleration=cars['acceleration'], brake=cars['brake'], fov=cars['fov'], name=cars['name'], track_id=cars['track_id'],
+			wheel=0, distance_front=0, distance_right=0, distance_left=0, w=False, a=False, s=False, d=False,
+			**dict((name, state[name]) for name in self.keyframe.names))
+		env.population = population
+		env.particles = [pyparticles.ParticleView(population, i) for i in range(n)]
+		env.leaderboards = {}
+
+	def set(self, env, state):
+		# put the recorded cars in env into the given state; their scores change every way at once
+		for name in self.keyframe.names:
+			getattr(env.population, name)[:] = state[name]
+		for board in env.leaderboards.values():
+			board.reset()
+
+	def move(self, env, population):
+		# one tick of motion and wall contact for the cars still being simulated, keeping their scores
+		if population.active.all():
+			active = population
+		else:
+			active = population.select(numpy.flatnonzero(population.active))
+		score = active.score.copy()
+		env.batch_motion(active)
+		if env.colliding:
+			env.batch_collide(active)
+		active.score[:] = score
+		if active is not population:
+			population.scatter(active)
+
+	def lap(self, car):
+		'''the first and last tick of the fastest lap recorded car number car completed, or None if it completed none'''
+
+		state = self.last[car]
+		if state['fastest_lap'] >= 999999:
+			return None
+		times = self.times[:len(self)]
+		return int(numpy.searchsorted(times, state['stopwatch'] - state['fastest_lap'])), int(numpy.searchsorted(times, state['stopwatch']))
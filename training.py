@@ -0,0 +1,312 @@
+# training.py
+# headless evaluation of drivers, usable from gaming_assembly and from worker processes
+
+import collections, concurrent.futures, hashlib, itertools, math, multiprocessing, queue
+from multiprocessing import shared_memory
+import numpy
+import pyparticles
+
+def environment(genomes, layout, size, image, checkpoints, car_size=5, culling=None, compact=False, timestep=1, substeps=1, swept=False):
+	'''a headless, vectorised Environment with a car for every row of a population matrix of genomes
+	standing at the first checkpoint of the track. Given lists of images and of checkpoints, every
+	genome gets a car on each of the tracks, all of the first track's cars coming first'''
+
+	env = pyparticles.Environment(size, image=image, checkpoints=checkpoints, colliding=False, vectorised=True, culling=culling, compact=compact)
+	env.timestep, env.substeps, env.swept = timestep, substeps, swept
+	track_id = numpy.repeat(numpy.arange(len(env.tracks)), len(genomes))
+	starts = numpy.array([points[0] for points in env.track_checkpoints], dtype=float)[track_id]
+	env.addGenomes(numpy.tile(genomes, (len(env.tracks), 1)), layout, x=starts[:,0], y=starts[:,1], speed=0, size=car_size, track_id=track_id)
+	return env
+
+def fitness(env, aggregate=numpy.mean):
+	'''the score of each genome of an environment(), aggregated over the tracks it drove'''
+	return aggregate(env.pack().score.reshape(len(env.tracks), -1), axis=0)
+
+def evaluate(genomes, layout, size, image, checkpoints, ticks, dt, seed=None, car_size=5, culling=None, aggregate=numpy.mean, compact=False,
+		timestep=1, substeps=1, swept=False):
+	'''drive each row of a population matrix of genomes from a standing start at the first
+	checkpoint for a fixed number of ticks of dt milliseconds in a headless Environment,
+	and return their scores. Each tick of the Environment stands for timestep of those ticks, so the
+	cars drive for the same simulated time whatever the timestep. With a culling policy, which counts
+	the Environment's ticks, the run ends early once every car is culled.
+	On several tracks, all are driven in the same Environment and the scores aggregated'''
+
+	if seed is not None:
+		pyparticles.seed(seed)
+
+	env = environment(genomes, layout, size, image, checkpoints, car_size, culling, compact, timestep, substeps, swept)
+
+	while env.ticks < ticks/timestep and not env.done:
+		env.advance(dt*timestep)
+
+	return fitness(env, aggregate)
+
+def next_generation(genomes, scores, layout, size, n_to_keep=10, n_new=5, elites=0, stages=None):
+	'''breed a new generation of size genomes from one that has been scored: the best elites genomes
+	carried over unchanged, then every pairing among the best n_to_keep, or as many as leave room for
+	the rest, then random pairs from the best size, then n_new brand new drivers. Given the stage of a
+	SuccessiveHalving each genome reached, genomes are ranked on it first and on score second'''
+
+	if stages is None:
+		ranking = sorted(range(len(scores)), key=lambda i:scores[i])[::-1]
+	else:
+		ranking = sorted(range(len(scores)), key=lambda i:(stages[i], scores[i]))[::-1]
+	parents = genomes[ranking]
+
+	pairs = [pair for i in range(n_to_keep-1) for pair in itertools.combinations(range(i+1),2)][:max(size - n_new - elites, 0)]
+	pairs += numpy.random.randint(0, size, (max(size - n_new - elites - len(pairs), 0), 2)).tolist()
+	return numpy.concatenate((parents[:elites], pyparticles.breed_generation(parents, pairs, layout), layout.random(n_new)))
+
+class SuccessiveHalving():
+	'''Drives the genomes of an environment() in stages rather than all for the whole run: once first_ticks
+	ticks have been run, only the best keep fraction of the genomes still being driven go on, the rest
+	being frozen with their scores as culled cars are, and so on after each stage 1/keep times as long as
+	the one before, until the survivors have been driven for ticks. Call it after every tick. A genome's
+	stage is the number of cuts it survived; as genomes dropped earlier were scored over a shorter drive,
+	rank them on their stage before their score'''
+
+	def __init__(self, env, ticks, first_ticks, keep=0.5, aggregate=numpy.mean):
+		self.env = env
+		self.ticks = ticks
+		self.keep = keep
+		self.aggregate = aggregate
+		self.horizon = first_ticks
+		n = env.pack().n//len(env.tracks)
+		self.stages = numpy.zeros(n, dtype=int)
+		self.racing = numpy.ones(n, dtype=bool)
+
+	def __call__(self):
+		'''at the end of a stage, freeze all but the best of the genomes still being driven'''
+
+		env = self.env
+		if env.ticks < self.horizon or self.horizon >= self.ticks:
+			return
+
+		racing = numpy.flatnonzero(self.racing)
+		scores = fitness(env, self.aggregate)[racing]
+		ranking = racing[numpy.argsort(-scores, kind='stable')]
+		kept = max(1, math.ceil(self.keep*len(racing)))
+		self.stages[ranking[:kept]] += 1
+		self.racing[ranking[kept:]] = False
+		env.pack().active.reshape(len(env.tracks), -1)[:, ranking[kept:]] = False
+
+		self.horizon = min(math.ceil(self.horizon/self.keep), self.ticks)
+
+class FitnessCache():
+	'''Scores of genomes already evaluated, so that elites and duplicates are not driven again.
+	A genome's key hashes its network weights and fov, rounded to resolution, together with context,
+	which should name everything else its score depends on: the tracks and their checkpoints, the ticks
+	and dt, the culling policy and so on. Only a deterministic evaluation, such as evaluate() with its
+	cars unable to collide, can be cached. Holds at most size scores, forgetting the least recently used,
+	and counts hits, and misses that had to be driven, until reset_counts()'''
+
+	def __init__(self, size, layout, context=None, resolution=1e-9):
+		self.size = size
+		self.layout = layout
+		self.resolution = resolution
+		self.context = hashlib.sha1(repr(context).encode()).digest()
+		self.scores = collections.OrderedDict()
+		self.reset_counts()
+
+	def reset_counts(self):
+		self.hits = 0
+		self.misses = 0
+
+	def keys(self, genomes):
+		'''the cache key of every row of a population matrix of genomes'''
+
+		genes = numpy.round(numpy.asarray(genomes)[:, :self.layout.fov + 1]/self.resolution).astype(numpy.int64)
+		return [hashlib.sha1(self.context + row.tobytes()).digest() for row in genes]
+
+	def __call__(self, genomes, evaluate):
+		'''the scores of a population matrix of genomes, calling evaluate(genomes) on the distinct
+		genomes that are not in the cache, and remembering what it returns'''
+
+		keys = self.keys(genomes)
+		scores = numpy.empty(len(keys))
+		missing = collections.OrderedDict()
+		for i, key in enumerate(keys):
+			if key in self.scores:
+				self.scores.move_to_end(key)
+				scores[i] = self.scores[key]
+				self.hits += 1
+			else:
+				# only the first copy of a genome missing from the cache is driven
+				if key in missing:
+					self.hits += 1
+				else:
+					self.misses += 1
+				missing.setdefault(key, []).append(i)
+
+		if missing:
+			first = [rows[0] for rows in missing.values()]
+			for (key, rows), score in zip(missing.items(), evaluate(genomes[first]).tolist()):
+				scores[rows] = score
+				self.scores[key] = score
+			while len(self.scores) > self.size:
+				self.scores.popitem(last=False)
+
+		return scores
+
+class ParallelEvaluator():
+	'''Scores whole generations on a pool of worker processes, each running its own Environment
+	on one shard of the population. Every shard of every generation gets its own seed, derived
+	from seed, so a run is reproducible for a given number of workers'''
+
+	def __init__(self, workers, seed=0, **settings):
+		self.workers = workers
+		self.seed = seed
+		self.settings = settings
+		self.generation = 0
+		self.pool = concurrent.futures.ProcessPoolExecutor(workers)
+
+	def __call__(self, genomes):
+		'''return the score of every row of a population matrix of genomes, in order'''
+
+		shards = numpy.array_split(numpy.arange(len(genomes)), self.workers)
+		seeds = numpy.random.SeedSequence((self.seed, self.generation)).generate_state(self.workers)
+		self.generation += 1
+
+		futures = [self.pool.submit(evaluate, genomes[shard], seed=int(seed), **self.settings)
+			for shard, seed in zip(shards, seeds) if shard.size]
+		return numpy.concatenate([future.result() for future in futures])
+
+	def close(self):
+		self.pool.shutdown()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+topologies = ('ring', 'full', 'random')
+
+def migration_sources(topology, island, islands, epoch, seed=0):
+	'''the islands that send migrants to island at the given migration: the one before it for a 'ring',
+	every other island when 'full', or for 'random' the island mapped to it by a random derangement
+	drawn afresh, but identically in every process, for each migration'''
+
+	if topology not in topologies:
+		raise ValueError('unknown topology '+repr(topology)+', use one of '+', '.join(topologies))
+	if islands < 2:
+		return []
+	if topology == 'ring':
+		return [(island - 1) % islands]
+	if topology == 'full':
+		return [source for source in range(islands) if source != island]
+
+	# shift every island along a random ordering of them by a random amount that is never a whole turn
+	generator = numpy.random.default_rng((seed, epoch))
+	order = generator.permutation(islands)
+	shift = generator.integers(1, islands)
+	position = numpy.flatnonzero(order == island)[0]
+	return [int(order[(position - shift) % islands])]
+
+class IslandModel():
+	'''A genetic algorithm split into islands, each a sub-population evolved by next_generation in its
+	own worker process. Every migration_interval generations each island writes copies of its best
+	migrants genomes, with their scores, to its slot of a shared memory buffer, and once every island
+	has written, replaces its worst genomes with those of the islands migration_sources picks for it.
+	Each island is seeded from seed and its number, so a run is reproducible. n_to_keep and elites are
+	passed on to next_generation, and settings to evaluate'''
+
+	def __init__(self, islands, island_size, layout, migration_interval=5, migrants=2, topology='ring', n_to_keep=10, elites=0, seed=0, **settings):
+		migration_sources(topology, 0, islands, 0)
+		self.islands = islands
+		self.island_size = island_size
+		self.layout = layout
+		self.migration_interval = migration_interval
+		self.migrants = migrants
+		self.topology = topology
+		self.n_to_keep = n_to_keep
+		self.elites = elites
+		self.seed = seed
+		self.settings = settings
+
+	def run(self, generations, genomes=None, callback=None, first=0):
+		'''evolve for generations, starting from island_size random genomes on each island or from
+		genomes shared out between them, and return the last generation's genomes and scores.
+		callback(generation, genomes, scores) is given every island's genomes together as each
+		generation is scored, numbered on from first'''
+
+		if genomes is None:
+			starts = [None]*self.islands
+		else:
+			starts = numpy.array_split(numpy.asarray(genomes, dtype=self.layout.dtype), self.islands)
+
+		width = self.layout.size + 1
+		buffer = shared_memory.SharedMemory(create=True, size=8*self.islands*self.migrants*width)
+		context = multiprocessing.get_context()
+		barrier = context.Barrier(self.islands)
+		results = context.Queue()
+		workers = [context.Process(target=_island, args=(self, i, starts[i], generations, buffer.name, barrier, results), daemon=True)
+			for i in range(self.islands)]
+
+		try:
+			for worker in workers:
+				worker.start()
+
+			reported = {}
+			for _ in range(generations*self.islands):
+				while True:
+					try:
+						generation, island, island_genomes, island_scores = results.get(timeout=1)
+						break
+					except queue.Empty:
+						if any(worker.exitcode not in (None, 0) for worker in workers):
+							raise RuntimeError('an island worker failed')
+
+				reported.setdefault(generation, {})[island] = (island_genomes, island_scores)
+				if len(reported[generation]) == self.islands:
+					parts = reported.pop(generation)
+					genomes = numpy.concatenate([parts[i][0] for i in range(self.islands)])
+					scores = numpy.concatenate([parts[i][1] for i in range(self.islands)])
+					if callback is not None:
+						callback(first + generation, genomes, scores)
+
+			for worker in workers:
+				worker.join()
+		finally:
+			for worker in workers:
+				if worker.is_alive():
+					worker.terminate()
+			buffer.close()
+			buffer.unlink()
+
+		return genomes, scores
+
+def _island(model, island, genomes, generations, buffer_name, barrier, results):
+	# the loop of one island of an IslandModel, run in its own process
+
+	pyparticles.seed(int(numpy.random.SeedSequence((model.seed, island)).generate_state(1)[0]))
+	buffer = shared_memory.SharedMemory(name=buffer_name)
+	slots = numpy.ndarray((model.islands, model.migrants, model.layout.size + 1), dtype=float, buffer=buffer.buf)
+	layout = model.layout
+	if genomes is None:
+		genomes = layout.random(model.island_size)
+
+	try:
+		for generation in range(generations):
+			scores = evaluate(genomes, layout, **model.settings)
+			last = generation == generations - 1
+
+			if model.islands > 1 and not last and (generation + 1) % model.migration_interval == 0:
+				epoch = (generation + 1) // model.migration_interval
+				best = numpy.argsort(-scores, kind='stable')[:model.migrants]
+				slots[island, :len(best), :-1] = genomes[best]
+				slots[island, :len(best), -1] = scores[best]
+				barrier.wait()
+
+				arrivals = numpy.concatenate([slots[source] for source in migration_sources(model.topology, island, model.islands, epoch, model.seed)])
+				worst = numpy.argsort(scores, kind='stable')[:len(arrivals)]
+				genomes, scores = genomes.copy(), scores.copy()
+				genomes[worst], scores[worst] = arrivals[:, :-1], arrivals[:, -1]
+				barrier.wait()
+
+			results.put((generation, island, genomes, scores))
+			if not last:
+				genomes = next_generation(genomes, scores, layout, model.island_size, model.n_to_keep, elites=model.elites)
+	finally:
+		del slots
+		buffer.close()